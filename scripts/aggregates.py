@@ -0,0 +1,127 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from batching import resolve_pairs, stream_series, window_rows, window_start
+from qc import QC_RANGE, SeriesBatch
+from series_store import stream_window
+
+# Rolling per-station aggregates the dashboard used to compute in the browser: rainfall total,
+# temperature mean/min/max and mean solar radiation over the last 24 hours, 3 days and 7 days
+
+AGGREGATE_VARS = ["RF_1_Tot300s", "Tair_1_Avg", "SWin_1_Avg"]
+
+# Window name -> hours
+WINDOWS = {"24-hour": 24, "3-day": 72, "7-day": 168}
+LONGEST_WINDOW = max(WINDOWS.values())
+
+# Output field -> (aggregate, source variable)
+AGGREGATE_OUTPUTS = {
+    "rainfall_total": ("sum", "RF_1_Tot300s"),
+    "tair_mean": ("mean", "Tair_1_Avg"),
+    "tair_min": ("min", "Tair_1_Avg"),
+    "tair_max": ("max", "Tair_1_Avg"),
+    "swin_mean": ("mean", "SWin_1_Avg")
+}
+
+
+class AggregateAccumulator:
+    """Sum, count, min and max per (station, variable, window) of the rows streamed in.
+
+    Only the variable id each (station, AGGREGATE_VARS entry) resolves to is
+    counted: batches, and other stages sharing the store, also bring in
+    variants a station is not read from. Rows come from stream_series() or
+    the series store, so each arrives once.
+
+    Rows are gathered in a SeriesBatch; finish() checks them all in one
+    qc_flags pass and computes every window at once. Values failing the
+    range test are left out, and each window carries the OR of the flags
+    of its samples.
+    """
+
+    def __init__(self, station_ids, now, capabilities=None):
+        resolved = resolve_pairs([(s, v) for s in station_ids for v in AGGREGATE_VARS], capabilities)
+        self.wanted = {(station_id, actual): variable for (station_id, variable), actual in resolved.items()}
+        self.cutoffs = {window: (now - timedelta(hours=hours)).timestamp() for window, hours in WINDOWS.items()}
+        self.batch = SeriesBatch()
+        self.newest = {}
+        self.stats = {}
+        self.flags = {}
+
+    def add(self, entry):
+        key = (entry["station_id"], entry["variable"])
+        if key in self.wanted:
+            self.batch.add(key, key[1], entry["timestamp"], entry.get("value"))
+
+    def finish(self):
+        codes, variables, times, values, flags = self.batch.arrays()
+        keys = self.batch.keys
+        newest = {}
+        for code, (time, timestamp) in self.batch.newest.items():
+            station_id = keys[code][0]
+            if station_id not in newest or time > newest[station_id][0]:
+                newest[station_id] = (time, timestamp)
+        self.newest = {station_id: timestamp for station_id, (_, timestamp) in newest.items()}
+
+        # Values outside the sensor's physical range would skew every window they fall in
+        usable = ~np.isnan(values) & (flags & QC_RANGE == 0)
+        frame = pd.DataFrame({
+            "code": codes, "station_id": np.array([station_id for station_id, _ in keys], dtype=object)[codes],
+            "value": values, "qc": flags
+        })
+        # Same edges as the 24-hour rainfall product: samples strictly after the cutoff
+        for window, cutoff in self.cutoffs.items():
+            inside = times > cutoff
+            stats = frame[inside & usable].groupby("code")["value"].agg(["sum", "count", "min", "max"])
+            for code, total, count, low, high in stats.itertuples():
+                self.stats[(keys[code][0], self.wanted[keys[code]], window)] = [total, count, low, high]
+            window_flags = frame[inside & ~np.isnan(values)].groupby("station_id")["qc"].agg(np.bitwise_or.reduce)
+            self.flags.update({(station_id, window): int(qc) for station_id, qc in window_flags.items()})
+        return self
+
+    def value(self, station_id, variable, window, stat):
+        stats = self.stats.get((station_id, variable, window))
+        if stats is None:
+            return None
+        total, count, low, high = stats
+        return {"sum": total, "mean": total / count, "min": low, "max": high}[stat]
+
+
+async def collect_aggregates(engine, store, station_ids, now, capabilities=None):
+    """Streams every AGGREGATE_VARS row of the longest window into an AggregateAccumulator.
+
+    With a store only samples newer than what it already holds are fetched,
+    so after the first run each update costs one small delta query.
+    Returns the accumulator with every window computed.
+    """
+    accumulator = AggregateAccumulator(station_ids, now, capabilities)
+    if store is not None:
+        await stream_window(engine, store, station_ids, AGGREGATE_VARS, LONGEST_WINDOW, accumulator.add, now, capabilities)
+    else:
+        await stream_series(
+            engine, station_ids, AGGREGATE_VARS, window_start(now, LONGEST_WINDOW), window_rows(LONGEST_WINDOW),
+            accumulator.add, capabilities=capabilities
+        )
+    return accumulator.finish()
+
+
+def build_aggregates(station_ids, accumulator):
+    # {station_id: {"timestamp": newest sample, window: {field: value, "qc": flags}}}; fields without samples are None
+    aggregates = {}
+    for station_id in station_ids:
+        aggregates[station_id] = {"timestamp": accumulator.newest.get(station_id)}
+        for window in WINDOWS:
+            aggregates[station_id][window] = {}
+            for field, (stat, variable) in AGGREGATE_OUTPUTS.items():
+                value = accumulator.value(station_id, variable, window, stat)
+                aggregates[station_id][window][field] = None if value is None else round(value, 2)
+            aggregates[station_id][window]["qc"] = accumulator.flags.get((station_id, window))
+    return aggregates
+
+
+def save_aggregates(aggregates, writer):
+    # One small file per station, so a dashboard page reads a handful of numbers
+    for station_id, values in aggregates.items():
+        writer.write_json(f"aggregates_{station_id}.json", values)
+
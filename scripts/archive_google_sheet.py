@@ -0,0 +1,149 @@
+import argparse
+import csv
+import gzip
+import os
+import tempfile
+from datetime import datetime, timezone
+
+# Monthly archive of the Google Sheet run log: the log tab is read in row chunks and streamed into a
+# gzipped CSV, then exactly the archived rows are deleted in one batch update. Rows appended while the
+# archive is written stay in the sheet for next month.
+
+SPREADSHEET_ID = os.getenv("LOG_SPREADSHEET_ID", "1yovub3qO0T1MQCC-KXGicq8BlzkAEE9IcCFTdEWW3tQ")
+SHEET = "Logs"
+CHUNK_ROWS = 5000  # rows per values().get, well under the API's response size limit
+NUM_RETRIES = 3  # retries googleapiclient makes on 429/5xx before giving up
+
+
+def build_service():
+    # Sheets v4 service from the service account in GOOGLE_APPLICATION_CREDENTIALS
+    from google.oauth2.service_account import Credentials
+    from googleapiclient.discovery import build
+
+    creds_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+    if not creds_path or not os.path.exists(creds_path):
+        raise RuntimeError("GOOGLE_APPLICATION_CREDENTIALS is not set or file does not exist")
+    creds = Credentials.from_service_account_file(creds_path, scopes=["https://www.googleapis.com/auth/spreadsheets"])
+    return build("sheets", "v4", credentials=creds)
+
+
+def sheet_properties(service, spreadsheet_id=SPREADSHEET_ID, sheet=SHEET):
+    # (sheet id, grid row count) of the tab; row ranges past the grid are rejected by the API
+    spreadsheet = service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id, fields="sheets.properties(sheetId,title,gridProperties.rowCount)"
+    ).execute(num_retries=NUM_RETRIES)
+    for entry in spreadsheet.get("sheets", []):
+        properties = entry["properties"]
+        if properties["title"] == sheet:
+            return properties["sheetId"], properties["gridProperties"]["rowCount"]
+    raise RuntimeError(f"Sheet {sheet!r} not found in spreadsheet {spreadsheet_id}")
+
+
+def read_rows(service, first, last, spreadsheet_id=SPREADSHEET_ID, sheet=SHEET):
+    # Rows first..last (1-based, inclusive); trailing empty rows are left out by the API
+    result = service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id, range=f"{sheet}!{first}:{last}"
+    ).execute(num_retries=NUM_RETRIES)
+    return result.get("values", [])
+
+
+def iter_log_rows(service, chunk_rows=CHUNK_ROWS, spreadsheet_id=SPREADSHEET_ID, sheet=SHEET):
+    """Yields the data rows below the header, one chunk request at a time.
+
+    Reading stops at the first chunk that comes back short: that chunk
+    ended in empty rows, so everything yielded is a contiguous block
+    starting at row 2.
+    """
+    _, row_count = sheet_properties(service, spreadsheet_id, sheet)
+    first = 2
+    while first <= row_count:
+        last = min(first + chunk_rows - 1, row_count)
+        rows = read_rows(service, first, last, spreadsheet_id, sheet)
+        yield from rows
+        if len(rows) < last - first + 1:
+            return
+        first = last + 1
+
+
+def archive_log(service, path, chunk_rows=CHUNK_ROWS, spreadsheet_id=SPREADSHEET_ID, sheet=SHEET):
+    """Streams the header and data rows into a gzipped CSV at path; returns the number of data rows.
+
+    The archive only appears at path once it is complete, so a failed run
+    never leaves a truncated archive behind to be cleared against.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    count = 0
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", newline="", encoding="utf-8") as archive:
+            writer = csv.writer(archive)
+            writer.writerows(read_rows(service, 1, 1, spreadsheet_id, sheet))
+            for row in iter_log_rows(service, chunk_rows, spreadsheet_id, sheet):
+                writer.writerow(row)
+                count += 1
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    print(f"Archived {count} rows to {path}")
+    return count
+
+
+def archived_rows(path):
+    # (first data row, number of data rows) of an archive written by archive_log
+    with gzip.open(path, "rt", newline="", encoding="utf-8") as archive:
+        reader = csv.reader(archive)
+        next(reader, None)  # header
+        first = next(reader, None)
+        return first, (0 if first is None else 1 + sum(1 for _ in reader))
+
+
+def delete_rows(service, count, spreadsheet_id=SPREADSHEET_ID, sheet=SHEET):
+    # Deletes data rows 2..count+1 in one batch update; rows below move up, so later appends are kept
+    if count <= 0:
+        print("Nothing to clear")
+        return
+    sheet_id, _ = sheet_properties(service, spreadsheet_id, sheet)
+    service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": [{
+        "deleteDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": 1, "endIndex": 1 + count}}
+    }]}).execute(num_retries=NUM_RETRIES)
+    print(f"Cleared {count} archived rows from {sheet}")
+
+
+def clear_archived(service, path, spreadsheet_id=SPREADSHEET_ID, sheet=SHEET):
+    """Deletes the rows an archive holds, after checking the sheet still starts with them.
+
+    Returns the number of rows deleted; if row 2 no longer matches the
+    archive's first row (the log was edited or cleared since), nothing is.
+    """
+    first, count = archived_rows(path)
+    if count == 0:
+        print("Nothing to clear")
+        return 0
+    # The CSV round trip turns every cell into a string, as the sheet's formatted values already are
+    current = read_rows(service, 2, 2, spreadsheet_id, sheet)
+    if not current or [str(cell) for cell in current[0]] != first:
+        print(f"Row 2 of {sheet} does not match {path}, leaving the sheet unchanged")
+        return 0
+    delete_rows(service, count, spreadsheet_id, sheet)
+    return count
+
+
+def default_archive_path(directory):
+    return os.path.join(directory, f"google_sheet_{datetime.now(timezone.utc):%Y-%m-%d}.csv.gz")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive the Google Sheet run log to a gzipped CSV")
+    parser.add_argument("--output", default="data/Run Data Map Measurements", help="archive directory")
+    parser.add_argument("--path", help="archive file; defaults to <output>/google_sheet_YYYY-MM-DD.csv.gz")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--clear", action="store_true", help="delete the archived rows from the sheet afterwards")
+    args = parser.parse_args()
+
+    service = build_service()
+    path = args.path or default_archive_path(args.output)
+    archive_log(service, path, args.chunk_rows)
+    if args.clear:
+        clear_archived(service, path)
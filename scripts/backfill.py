@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import csv
+import glob
+import io
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from batching import build_batches, fetch_batch, resolve_query, rows_since
+from capabilities import load_capabilities, normalize_station_id
+from climatology import CLIMO_VARIABLES, CLIMOS_DIR, HST, MONTHS
+from hcdp import FetchEngine, DEFAULT_CONCURRENCY, stations_url, track_failures
+from output import atomic_write
+from records import epoch_seconds, float_values
+
+try:
+    import pyarrow  # noqa: F401  (pandas' parquet engine)
+    EXTENSION = "parquet"
+except ImportError:  # compressed numpy archives hold the same columns
+    EXTENSION = "npz"
+
+# Historical backfill: a station set and date range split into time chunks, fetched by a pool of
+# workers and written as columnar files partitioned by station and month. Completed chunks are
+# checkpointed, so an interrupted run picks up where it stopped.
+#
+#   python backfill.py --start 2024-01-01 --end 2025-01-01 --climatology climos_draft
+#
+# Compare the drafts with the curated normals in public/climos before copying any over; writing
+# straight into public/climos takes --overwrite-climos.
+
+DEFAULT_OUTPUT = os.getenv("BACKFILL_DIR", "backfill")
+DEFAULT_VARIABLES = ["RF_1_Tot300s", "Tair_1_Avg"]
+CHUNK_DAYS = 7
+REQUEST_TIMEOUT = 60  # a chunk body is much larger than the 24-hour queries
+
+# Source variables of the climatology columns
+RAIN_VARIABLE = "RF_1_Tot300s"
+TEMPERATURE_VARIABLE = "Tair_1_Avg"
+
+
+def iso(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_date(value):
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def end_date(end):
+    # The API's end_date is inclusive; chunks are half-open so neighbours do not share a sample
+    return iso(end - timedelta(seconds=1))
+
+
+def chunk_key(station_id, start, end):
+    return f"{station_id}|{iso(start)}|{iso(end)}"
+
+
+def plan_chunks(station_ids, var_ids, start, end, chunk_days, done):
+    # [(station batch, start, end)] still to fetch; each time chunk's pending stations are packed into batches
+    chunks = []
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days), end)
+        pending = [sid for sid in station_ids if chunk_key(sid, chunk_start, chunk_end) not in done]
+        rows = rows_since(chunk_start, chunk_end)
+        for batch in build_batches(pending, var_ids, rows, iso(chunk_start), end_date=end_date(chunk_end)):
+            chunks.append((batch, chunk_start, chunk_end))
+        chunk_start = chunk_end
+    return chunks
+
+
+class Checkpoint:
+    """Keys of the (station, chunk) pairs already written, saved after every chunk.
+
+    The keys only hold for one variable list, so a checkpoint written for
+    other variables is not reused.
+    """
+
+    def __init__(self, path, var_ids):
+        self.path = path
+        self.var_ids = list(var_ids)
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            if saved.get("variables") == self.var_ids:
+                self.done = set(saved["done"])
+            else:
+                print(f"Checkpoint {path} is for variables {saved.get('variables')}, starting over")
+
+    def mark(self, keys):
+        self.done.update(keys)
+        payload = {"variables": self.var_ids, "done": sorted(self.done)}
+        atomic_write(self.path, json.dumps(payload, separators=(",", ":")).encode())
+
+
+def partition_dir(output, station_id, month):
+    return os.path.join(output, f"station={station_id}", f"month={month}")
+
+
+def write_partition(path, frame):
+    buffer = io.BytesIO()
+    if EXTENSION == "parquet":
+        frame.to_parquet(buffer, index=False)
+    else:
+        np.savez_compressed(
+            buffer, variable=frame["variable"].to_numpy(dtype=str), time=frame["time"].to_numpy(dtype="int64"),
+            value=frame["value"].to_numpy(dtype=float)
+        )
+    atomic_write(path, buffer.getvalue())
+
+
+def read_partition(path):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    with np.load(path) as archive:
+        return pd.DataFrame({"variable": archive["variable"], "time": archive["time"], "value": archive["value"]})
+
+
+def write_chunk(output, rows, start):
+    # One file per (station, month) the chunk touches, named after the chunk so a rerun overwrites it
+    frame = pd.DataFrame({
+        "station_id": [entry["station_id"] for entry in rows],
+        "variable": [entry["variable"] for entry in rows],
+        "time": epoch_seconds([entry["timestamp"] for entry in rows]),
+        "value": float_values([entry.get("value") for entry in rows])
+    })
+    # A split or retried request can hand out the same rows twice
+    frame = frame.drop_duplicates(["station_id", "variable", "time"]).sort_values(["station_id", "variable", "time"])
+    months = pd.to_datetime(frame["time"], unit="s", utc=True).dt.strftime("%Y-%m")
+    for (station_id, month), partition in frame.groupby([frame["station_id"], months]):
+        directory = partition_dir(output, station_id, month)
+        os.makedirs(directory, exist_ok=True)
+        write_partition(os.path.join(directory, f"part-{start:%Y%m%dT%H%M}.{EXTENSION}"), partition.drop(columns="station_id"))
+
+
+async def run_chunk(engine, checkpoint, output, var_ids, chunk):
+    batch, start, end = chunk
+    rows = []
+    _, failed = await track_failures(fetch_batch(
+        engine, batch, var_ids, rows_since(start, end), iso(start), REQUEST_TIMEOUT, rows.append, end_date(end)
+    ))
+    # Rows of a station with a failed request may be partial: they are dropped and the station stays pending
+    complete = [sid for sid in batch if sid not in failed]
+    rows = [entry for entry in rows if entry["station_id"] in complete]
+    if rows:
+        write_chunk(output, rows, start)
+    checkpoint.mark(chunk_key(sid, start, end) for sid in complete)
+    print(f"{start:%Y-%m-%d}..{end:%Y-%m-%d} {','.join(batch)}: {len(rows)} rows" + (f", failed {','.join(sorted(failed))}" if failed else ""))
+    return not failed
+
+
+async def backfill(station_ids, var_ids, start, end, output=DEFAULT_OUTPUT, chunk_days=CHUNK_DAYS, workers=DEFAULT_CONCURRENCY, checkpoint_path=None):
+    """Fetches every chunk not in the checkpoint over `workers` concurrent workers.
+
+    Returns the number of chunks that failed; running again with the same
+    arguments retries just those.
+    """
+    os.makedirs(output, exist_ok=True)
+    capabilities = load_capabilities()
+    checkpoint = Checkpoint(checkpoint_path or os.path.join(output, "checkpoint.json"), var_ids)
+
+    # Chunk bodies are large and never requested twice: caching them would only evict the live jobs' entries
+    async with FetchEngine(DEFAULT_CONCURRENCY, cache=False) as engine:
+        if station_ids is None:
+            stations = await engine.get_json(stations_url, timeout=30)
+            if not stations:
+                print("Failed to retrieve stations")
+                return 1
+            station_ids = [station["station_id"] for station in stations]
+        station_ids, query_vars = resolve_query(station_ids, var_ids, capabilities)
+        chunks = plan_chunks(station_ids, query_vars, start, end, chunk_days, checkpoint.done)
+        print(f"{len(chunks)} chunks to fetch for {len(station_ids)} stations, {iso(start)} to {iso(end)}")
+
+        # Workers share one iterator, so each chunk is taken exactly once
+        pending = iter(chunks)
+        failures = []
+
+        async def worker():
+            for chunk in pending:
+                if not await run_chunk(engine, checkpoint, output, query_vars, chunk):
+                    failures.append(chunk)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+
+    if failures:
+        print(f"{len(failures)} of {len(chunks)} chunks failed; run again to retry them")
+    return len(failures)
+
+
+def scan(output=DEFAULT_OUTPUT, station_ids=None, variables=None, start=None, end=None):
+    """Rows of the backfilled partitions as one DataFrame (station_id, variable, time, value).
+
+    Partitions outside the stations or months asked for are never opened;
+    time is epoch seconds and start/end (datetimes) bound it half-open.
+    """
+    wanted = None if station_ids is None else {normalize_station_id(s) for s in station_ids}
+    first = None if start is None else f"{start:%Y-%m}"
+    last = None if end is None else f"{end:%Y-%m}"
+    frames = []
+    for station_dir in sorted(glob.glob(os.path.join(output, "station=*"))):
+        station_id = os.path.basename(station_dir).split("=", 1)[1]
+        if wanted is not None and normalize_station_id(station_id) not in wanted:
+            continue
+        for month_dir in sorted(glob.glob(os.path.join(station_dir, "month=*"))):
+            month = os.path.basename(month_dir).split("=", 1)[1]
+            if (first and month < first) or (last and month > last):
+                continue
+            for path in sorted(glob.glob(os.path.join(month_dir, "part-*"))):
+                frame = read_partition(path)
+                frame.insert(0, "station_id", station_id)
+                frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame({"station_id": [], "variable": [], "time": np.empty(0, dtype="int64"), "value": []})
+    frame = pd.concat(frames, ignore_index=True)
+    if variables is not None:
+        frame = frame[frame["variable"].isin(variables)]
+    if start is not None:
+        frame = frame[frame["time"] >= int(start.timestamp())]
+    if end is not None:
+        frame = frame[frame["time"] < int(end.timestamp())]
+    return frame.drop_duplicates(["station_id", "variable", "time"]).sort_values(["station_id", "variable", "time"], ignore_index=True)
+
+
+def monthly_climatology(rain, temperature):
+    """{climatology column: 12 monthly values} from one station's rainfall and temperature rows.
+
+    Days are Hawaii days. A month's rainfall is its mean daily total over
+    the days with data times the days in the month, so gaps do not read as
+    dry days; temperatures are means of the daily mean, min and max. Each
+    month of the year is then averaged over the years it was seen.
+    """
+    columns = {}
+    if len(rain):
+        days = pd.to_datetime(rain["time"], unit="s", utc=True).dt.tz_convert(HST)
+        daily = rain.groupby(days.dt.date)["value"].sum()
+        daily.index = pd.to_datetime(daily.index)
+        monthly = daily.groupby([daily.index.year, daily.index.month]).mean()
+        monthly *= [pd.Period(year=y, month=m, freq="M").days_in_month for y, m in monthly.index]
+        columns["RF_mm"] = monthly.groupby(level=1).mean()
+    if len(temperature):
+        days = pd.to_datetime(temperature["time"], unit="s", utc=True).dt.tz_convert(HST)
+        daily = temperature.groupby(days.dt.date)["value"].agg(["mean", "min", "max"])
+        daily.index = pd.to_datetime(daily.index)
+        for column, stat in (("Tmean_c", "mean"), ("Tmin_c", "min"), ("Tmax_c", "max")):
+            columns[column] = daily[stat].groupby(daily.index.month).mean()
+
+    table = {column: [np.nan] * len(MONTHS) for column in CLIMO_VARIABLES}
+    for column, values in columns.items():
+        for month, value in values.items():
+            table[column][month - 1] = value
+    table["RF_in"] = [v / 25.4 for v in table["RF_mm"]]
+    for unit in ("mean", "min", "max"):
+        table[f"T{unit}_f"] = [v * 9 / 5 + 32 for v in table[f"T{unit}_c"]]
+    return table
+
+
+def save_climatologies(output, directory, station_ids=None, capabilities=None):
+    # NNNN_climatology.csv in the public/climos layout for every backfilled station with rainfall or temperature
+    frame = scan(output, station_ids)
+    os.makedirs(directory, exist_ok=True)
+    for station_id, rows in frame.groupby("station_id"):
+        rain_variable = capabilities.resolve(station_id, RAIN_VARIABLE) if capabilities else RAIN_VARIABLE
+        table = monthly_climatology(rows[rows["variable"] == rain_variable], rows[rows["variable"] == TEMPERATURE_VARIABLE])
+        path = os.path.join(directory, f"{station_id}_climatology.csv")
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["Month"] + CLIMO_VARIABLES)
+            for i, month in enumerate(MONTHS):
+                writer.writerow([month] + ["" if np.isnan(table[c][i]) else round(float(table[c][i]), 2) for c in CLIMO_VARIABLES])
+        print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill historical measurements into station/month partitions")
+    parser.add_argument("--start", required=True, help="first date (UTC), e.g. 2024-01-01")
+    parser.add_argument("--end", help="end date (UTC, exclusive); defaults to now")
+    parser.add_argument("--stations", help="comma-separated station ids; defaults to every station")
+    parser.add_argument("--variables", default=",".join(DEFAULT_VARIABLES), help="comma-separated variable ids")
+    parser.add_argument("--chunk-days", type=float, default=CHUNK_DAYS, help="days of data per request chunk")
+    parser.add_argument("--workers", type=int, default=DEFAULT_CONCURRENCY, help="chunks fetched at the same time")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="partition directory")
+    parser.add_argument("--checkpoint", help="checkpoint file; defaults to <output>/checkpoint.json")
+    parser.add_argument("--climatology", metavar="DIR", help="also write NNNN_climatology.csv files from the partitions")
+    parser.add_argument("--overwrite-climos", action="store_true", help="allow --climatology to replace the curated files in public/climos")
+    args = parser.parse_args()
+    if args.climatology and os.path.realpath(args.climatology) == os.path.realpath(CLIMOS_DIR) and not args.overwrite_climos:
+        parser.error(f"--climatology {args.climatology} would overwrite the curated normals in {CLIMOS_DIR}; pass --overwrite-climos to do so")
+
+    start = parse_date(args.start)
+    end = parse_date(args.end) if args.end else datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    station_ids = [s.strip() for s in args.stations.split(",") if s.strip()] if args.stations else None
+    variables = [v.strip() for v in args.variables.split(",") if v.strip()]
+
+    failed = asyncio.run(backfill(station_ids, variables, start, end, args.output, args.chunk_days, args.workers, args.checkpoint))
+    if args.climatology:
+        save_climatologies(args.output, args.climatology, station_ids, load_capabilities())
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,208 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from hcdp import measurements_url
+from qc import latest_records
+
+# Packs many stations into each measurements request and splits the rows back out per (station, variable)
+
+MAX_URL_LENGTH = 2000
+MAX_ROWS = 20000
+
+# Latest-value queries look back this far in the batched pass; anything older is picked up by single-series fallback queries
+LATEST_WINDOW_HOURS = 1
+ROWS_PER_HOUR = 12  # 5-minute data
+SAMPLE_MINUTES = 5
+
+
+def rows_since(start, now):
+    # Samples per series from start (inclusive) to now, plus one spare: a window that comes back
+    # exactly full would otherwise look truncated and make fetch_batch split it for nothing
+    minutes = (now - start).total_seconds() / 60
+    return max(1, int(minutes // SAMPLE_MINUTES) + 2)
+
+
+def window_rows(hours):
+    # Rows per series for a window_start() window, which can hold one sample more than hours * ROWS_PER_HOUR
+    return hours * ROWS_PER_HOUR + 2
+
+
+def window_start(now, hours):
+    # Start of a look-back window, floored to the 5-minute sample grid so every run in the same
+    # interval sends an identical query (and hits the response cache); covers at most one extra sample,
+    # which within_window() drops again
+    start = now - timedelta(hours=hours)
+    start -= timedelta(minutes=start.minute % SAMPLE_MINUTES, seconds=start.second, microseconds=start.microsecond)
+    return start.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def within_window(consume, now, hours):
+    # Wraps consume so it only sees rows from exactly `hours` before now on, not the grid-floored query start.
+    # API timestamps are UTC, so comparing up to the seconds is comparing times.
+    cutoff = (now - timedelta(hours=hours)).strftime("%Y-%m-%dT%H:%M:%S")
+
+    def take(entry):
+        if entry["timestamp"][:19] >= cutoff:
+            consume(entry)
+    return take
+
+
+def drop_repeats(consume):
+    # Wraps consume so every row reaches it once: rows come newest first within each series, so a row
+    # not older than the last one passed on for its series is a repeat from a retried or split request
+    oldest = {}
+
+    def take(entry):
+        key = (entry["station_id"], entry["variable"])
+        timestamp = entry["timestamp"]
+        if key in oldest and timestamp >= oldest[key]:
+            return
+        oldest[key] = timestamp
+        consume(entry)
+    return take
+
+
+def build_url(station_ids, var_ids, limit, start_date=None, end_date=None):
+    query_string = f"station_ids={','.join(station_ids)}&var_ids={','.join(var_ids)}&limit={limit}"
+    if start_date:
+        query_string += f"&start_date={start_date}"
+    if end_date:
+        query_string += f"&end_date={end_date}"
+    return f"{measurements_url}?{query_string}"
+
+
+def build_batches(station_ids, var_ids, rows_per_series, start_date=None, max_url_length=MAX_URL_LENGTH, max_rows=MAX_ROWS, end_date=None):
+    # Greedily fills each batch until adding a station would exceed the URL length or row limit
+    rows_per_station = len(var_ids) * rows_per_series
+    batches = []
+    batch = []
+
+    for station_id in station_ids:
+        candidate = batch + [station_id]
+        url = build_url(candidate, var_ids, len(candidate) * rows_per_station, start_date, end_date)
+        if batch and (len(url) > max_url_length or len(candidate) * rows_per_station > max_rows):
+            batches.append(batch)
+            batch = [station_id]
+        else:
+            batch = candidate
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def demux(rows):
+    # {(station_id, variable): [rows]} keeping the API's newest-first order
+    series = {}
+    for entry in rows:
+        series.setdefault((entry["station_id"], entry["variable"]), []).append(entry)
+    return series
+
+
+async def fetch_batch(engine, station_ids, var_ids, rows_per_series, start_date=None, timeout=10, consume=None, end_date=None):
+    # The batch's rows, or with `consume` the number of rows streamed into it
+    limit = len(station_ids) * len(var_ids) * rows_per_series
+    url = build_url(station_ids, var_ids, limit, start_date, end_date)
+
+    try:
+        rows = await engine.get_json(url, timeout=timeout, consume=consume)
+    except asyncio.TimeoutError:
+        print(f"Batch for stations {','.join(station_ids)} timed out")
+        rows = None
+    if consume is not None:
+        count = rows if isinstance(rows, int) else None
+    else:
+        count = len(rows) if isinstance(rows, list) else None
+
+    # A full page may have been truncated by the row limit, and a timeout may just mean the batch is too big: split and retry
+    if len(station_ids) > 1 and not engine.expired() and (count is None or count >= limit):
+        middle = len(station_ids) // 2
+        halves = await asyncio.gather(
+            fetch_batch(engine, station_ids[:middle], var_ids, rows_per_series, start_date, timeout, consume, end_date),
+            fetch_batch(engine, station_ids[middle:], var_ids, rows_per_series, start_date, timeout, consume, end_date)
+        )
+        return sum(halves) if consume is not None else [entry for half in halves for entry in half]
+
+    if consume is not None:
+        return count or 0
+    return rows if isinstance(rows, list) else []
+
+
+def resolve_pairs(pairs, capabilities=None):
+    # {(station_id, variable): variable id to query}, dropping pairs the station does not report
+    if capabilities is None:
+        return {pair: pair[1] for pair in pairs}
+    resolved = {}
+    for station_id, variable in pairs:
+        actual = capabilities.resolve(station_id, variable)
+        if actual is not None:
+            resolved[(station_id, variable)] = actual
+    return resolved
+
+
+def resolve_query(station_ids, var_ids, capabilities=None):
+    # Stations that report any of var_ids, and the union of variable ids to ask them for
+    if capabilities is None:
+        return station_ids, var_ids
+    resolved = resolve_pairs([(s, v) for s in station_ids for v in var_ids], capabilities)
+    return list(dict.fromkeys(station_id for station_id, _ in resolved)), list(dict.fromkeys(resolved.values()))
+
+
+async def fetch_series(engine, station_ids, var_ids, start_date, rows_per_series, timeout=10, capabilities=None):
+    # All rows since start_date for every (station, variable) pair, keyed by the variable id the station reports
+    station_ids, var_ids = resolve_query(station_ids, var_ids, capabilities)
+    batches = build_batches(station_ids, var_ids, rows_per_series, start_date)
+    results = await asyncio.gather(*(
+        fetch_batch(engine, batch, var_ids, rows_per_series, start_date, timeout) for batch in batches
+    ))
+    return demux(entry for rows in results for entry in rows)
+
+
+async def stream_series(engine, station_ids, var_ids, start_date, rows_per_series, consume, timeout=10, capabilities=None):
+    # Same query as fetch_series(), but every row goes straight into consume() as it is decoded, once even if
+    # a request was retried or split part way through; returns the row count received
+    station_ids, var_ids = resolve_query(station_ids, var_ids, capabilities)
+    batches = build_batches(station_ids, var_ids, rows_per_series, start_date)
+    consume = drop_repeats(consume)
+    counts = await asyncio.gather(*(
+        fetch_batch(engine, batch, var_ids, rows_per_series, start_date, timeout, consume) for batch in batches
+    ))
+    return sum(counts)
+
+
+async def fetch_single_latest(engine, station_id, variable, timeout=5):
+    url = f"{measurements_url}?station_ids={station_id}&var_ids={variable}&limit=1"
+    try:
+        data = await engine.get_json(url, timeout=timeout)
+    except asyncio.TimeoutError:
+        print(f"Skipping {variable} for station {station_id} (request timed out)")
+        return None
+    return data[0] if isinstance(data, list) and data else None
+
+
+async def fill_missing(engine, latest, pairs, capabilities=None, timeout=5):
+    # Falls back to one limit=1 query per pair the batched pass did not return, skipping variables the station does not carry
+    missing = resolve_pairs([pair for pair in pairs if pair not in latest], capabilities)
+    rows = await asyncio.gather(*(
+        fetch_single_latest(engine, station_id, actual, timeout) for (station_id, _), actual in missing.items()
+    ))
+    # A lone row only gets the range test
+    latest.update(latest_records({pair: [entry] for pair, entry in zip(missing, rows) if entry is not None}))
+    return latest
+
+
+async def fetch_latest(engine, station_ids, var_ids, window_hours=LATEST_WINDOW_HOURS, fallback=True, capabilities=None, timeout=10):
+    # {(station_id, variable): newest Measurement}; with a capability index, station variants (e.g. RF_1_Tot900s) stand in for the requested id
+    resolved = resolve_pairs([(s, v) for s in station_ids for v in var_ids], capabilities)
+    query_ids = list(dict.fromkeys(station_id for station_id, _ in resolved))
+    query_vars = list(dict.fromkeys(resolved.values()))
+
+    start_date = window_start(datetime.now(timezone.utc), window_hours)
+    series = await fetch_series(engine, query_ids, query_vars, start_date, window_rows(window_hours), timeout)
+
+    # The whole window goes through quality control in one pass, so each newest value is checked against the hour before it
+    latest = latest_records({pair: series.get((pair[0], actual)) for pair, actual in resolved.items()})
+
+    if fallback:
+        await fill_missing(engine, latest, list(resolved), capabilities)
+    return latest
@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+import mock_hcdp
+
+# End-to-end benchmark of the fetch scripts against mock_hcdp.py: wall time, requests, bytes and peak memory
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = ["datamap.py", "datamapMeasurements.py", "diagnosticMeasurements.py", "latestMeasurements.py"]
+
+
+def start_server(port, args):
+    command = [
+        sys.executable, os.path.join(SCRIPTS_DIR, "mock_hcdp.py"), "--port", str(port),
+        "--stations", str(args.stations), "--latency", str(args.latency), "--timeout-rate", str(args.timeout_rate),
+        "--error-rate", str(args.error_rate), "--hang", str(args.hang), "--seed", str(args.seed)
+    ]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get(f"http://localhost:{port}/_stats", timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"Mock server did not start on port {port}")
+
+
+def run_script(script, workdir, base_url):
+    # One run of a script in workdir; returns its metrics
+    requests.post(f"{base_url}/_reset", timeout=5)
+    env = {**os.environ, "HCDP_API_URL": base_url, "API_TOKEN": "benchmark"}
+    with open(os.path.join(workdir, f"{script}.log"), "w") as log:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(SCRIPTS_DIR, script)], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 gives this child's own resource usage, not the running maximum over all children
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - started
+    stats = requests.get(f"{base_url}/_stats", timeout=5).json()
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "script": script,
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "wall_seconds": round(wall, 3),
+        "requests": stats["requests"],
+        "bytes": stats["bytes"],
+        "peak_memory_mb": round(peak / 2 ** 20, 1),
+        "statuses": stats["statuses"],
+        "injected_timeouts": stats["injected_timeouts"],
+        "injected_errors": stats["injected_errors"]
+    }
+
+
+def print_table(results):
+    print(f"{'script':<28}{'run':>4}{'exit':>6}{'wall s':>9}{'requests':>10}{'MB sent':>9}{'peak MB':>9}")
+    for result in results:
+        print(
+            f"{result['script']:<28}{result['run']:>4}{result['exit_code']:>6}{result['wall_seconds']:>9.2f}"
+            f"{result['requests']:>10}{result['bytes'] / 2 ** 20:>9.2f}{result['peak_memory_mb']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the fetch scripts against the mock HCDP API")
+    parser.add_argument("--scripts", default=",".join(SCRIPTS), help="comma-separated scripts to run")
+    parser.add_argument("--runs", type=int, default=1, help="runs per script in the same directory; runs after the first see warm caches and state")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", help="also write the results to this file")
+    mock_hcdp.add_arguments(parser)
+    args = parser.parse_args()
+
+    # The scripts' own timeouts and deadlines apply unchanged; only the API location differs
+    base_url = f"http://localhost:{args.port}"
+    server = start_server(args.port, args)
+    results = []
+    try:
+        for script in args.scripts.split(","):
+            with tempfile.TemporaryDirectory(prefix="hcdp-bench-") as workdir:
+                for run in range(1, args.runs + 1):
+                    result = run_script(script, workdir, base_url)
+                    result["run"] = run
+                    results.append(result)
+                    if result["exit_code"] != 0:
+                        with open(os.path.join(workdir, f"{script}.log")) as log:
+                            print(f"{script} exited with {result['exit_code']}:\n{''.join(log.readlines()[-20:])}")
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=4)
+        print(f"Saved {args.json}")
@@ -0,0 +1,100 @@
+import asyncio
+import csv
+import os
+from datetime import datetime, timedelta, timezone
+
+from batching import fetch_series, window_rows
+from hcdp import FetchEngine, DEFAULT_CONCURRENCY, stations_url
+
+# Station -> variables index built from public/station_variables.csv, used to skip queries for variables a station does not report
+
+CAPABILITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "public", "station_variables.csv")
+
+# Alternate variable ids a station may carry in place of the one the scripts ask for
+VARIANTS = {
+    "RF_1_Tot300s": ["RF_1_Tot900s"],
+}
+
+REBUILD_WINDOW_HOURS = 2
+
+
+def normalize_station_id(station_id):
+    return str(station_id).strip().zfill(4)
+
+
+class CapabilityIndex:
+    """Precomputed station -> set of variable ids.
+
+    Stations missing from the index, or listed with no variables, are
+    unknown and are assumed to carry every variable. Variables the index
+    never lists at all (logger diagnostics like BattVolt or CellStr) are
+    assumed to exist everywhere.
+    """
+
+    def __init__(self, station_vars=None):
+        self.station_vars = station_vars or {}
+        self.known_vars = set().union(*self.station_vars.values()) if self.station_vars else set()
+
+    def resolve(self, station_id, variable):
+        # Returns the variable id to query for this station, or None if the station does not report it
+        carried = self.station_vars.get(normalize_station_id(station_id))
+        candidates = [variable] + VARIANTS.get(variable, [])
+        if not carried or not any(v in self.known_vars for v in candidates):
+            return variable
+        for candidate in candidates:
+            if candidate in carried:
+                return candidate
+        return None
+
+    def refresh(self, stations):
+        # Keeps the index in step with the stations endpoint: retired stations are dropped, new ones start out unknown
+        active_ids = {normalize_station_id(station["station_id"]) for station in stations}
+        self.station_vars = {sid: v for sid, v in self.station_vars.items() if sid in active_ids}
+        return self
+
+
+def load_capabilities(path=CAPABILITIES_PATH):
+    station_vars = {}
+    if not os.path.exists(path):
+        return CapabilityIndex()
+    with open(path, newline="") as csv_file:
+        for row in csv.DictReader(csv_file):
+            variables = (row.get("variables") or "").strip()
+            station_vars[normalize_station_id(row["station"])] = {v.strip() for v in variables.split(";") if v.strip()}
+    return CapabilityIndex(station_vars)
+
+
+def save_capabilities(index, path=CAPABILITIES_PATH):
+    with open(path, "w", newline="") as csv_file:
+        csv_file.write("station,variables\n")
+        for station_id in sorted(index.station_vars, key=int):
+            csv_file.write(f"{int(station_id)},{';'.join(sorted(index.station_vars[station_id]))}\n")
+
+
+async def rebuild(path=CAPABILITIES_PATH):
+    # Re-derives the index from recent data: any variable with rows in the last few hours counts as carried
+    index = load_capabilities(path)
+    all_vars = sorted(index.known_vars)
+    start_date = (datetime.now(timezone.utc) - timedelta(hours=REBUILD_WINDOW_HOURS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    async with FetchEngine(DEFAULT_CONCURRENCY) as engine:
+        stations = await engine.get_json(stations_url, timeout=30)
+        if not stations:
+            print("Failed to retrieve stations, leaving the index unchanged")
+            return
+        station_ids = [station["station_id"] for station in stations]
+        series = await fetch_series(engine, station_ids, all_vars, start_date, window_rows(REBUILD_WINDOW_HOURS))
+
+    found = {}
+    for station_id, variable in series:
+        found.setdefault(normalize_station_id(station_id), set()).add(variable)
+
+    # Stations that were silent in the window keep their previous entry
+    index.refresh(stations)
+    index.station_vars.update(found)
+    save_capabilities(index, path)
+    print(f"Saved {path} ({len(index.station_vars)} stations)")
+
+
+if __name__ == "__main__":
+    asyncio.run(rebuild())
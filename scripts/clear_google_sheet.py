@@ -1,21 +1,13 @@
-import os
-import json
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+import argparse
 
-# Load credentials from env
-creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-if not creds_path or not os.path.exists(creds_path):
-    raise RuntimeError("GOOGLE_APPLICATION_CREDENTIALS is not set or file does not exist")
+from archive_google_sheet import build_service, clear_archived
 
-creds = Credentials.from_service_account_file(creds_path, scopes=["https://www.googleapis.com/auth/spreadsheets"])
+# Clears the run log rows saved in an archive written by archive_google_sheet.py; anything
+# appended to the sheet after the archive was taken is kept
 
-# Setup Sheet info
-SPREADSHEET_ID = '1yovub3qO0T1MQCC-KXGicq8BlzkAEE9IcCFTdEWW3tQ'
-RANGE = 'Logs!2:100000000'
+parser = argparse.ArgumentParser(description="Delete the rows held in a run log archive from the Google Sheet")
+parser.add_argument("archive", help="google_sheet_YYYY-MM-DD.csv.gz written by archive_google_sheet.py")
+args = parser.parse_args()
 
-
-service = build('sheets', 'v4', credentials=creds)
-service.spreadsheets().values().clear(spreadsheetId=SPREADSHEET_ID, range=RANGE).execute()
-
-print("Sheet cleared.")
+service = build_service()
+clear_archived(service, args.archive)
@@ -0,0 +1,154 @@
+import argparse
+import calendar
+import csv
+import glob
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from capabilities import normalize_station_id
+
+# Monthly station climatologies compiled from public/climos/NNNN_climatology.csv into one
+# station x month x variable array, and the "vs. normal" anomalies of the latest data map values
+
+PUBLIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "public")
+CLIMOS_DIR = os.path.join(PUBLIC_DIR, "climos")
+BUNDLE_PATH = os.getenv("CLIMATOLOGY_BUNDLE", os.path.join(PUBLIC_DIR, "climatology_bundle.json"))
+
+CLIMO_VARIABLES = ["RF_mm", "Tmean_c", "Tmin_c", "Tmax_c", "RF_in", "Tmean_f", "Tmin_f", "Tmax_f"]
+MONTHS = list(calendar.month_name)[1:]
+
+# Station months follow local time; Hawaii does not observe daylight saving
+HST = timezone(timedelta(hours=-10))
+
+
+class ClimatologyBundle:
+    """Monthly normals for every station in one float array.
+
+    values[station, month - 1, variable] with the axes indexed by
+    station_ids and CLIMO_VARIABLES; a value missing from the source CSV is
+    NaN. The JSON form keeps the same axes and nests the values in that order.
+    """
+
+    def __init__(self, station_ids, values, variables=CLIMO_VARIABLES):
+        self.station_ids = list(station_ids)
+        self.variables = list(variables)
+        self.values = np.asarray(values, dtype=float).reshape(len(self.station_ids), len(MONTHS), len(self.variables))
+        self.station_index = {station_id: i for i, station_id in enumerate(self.station_ids)}
+        self.variable_index = {variable: i for i, variable in enumerate(self.variables)}
+
+    @classmethod
+    def from_csv_dir(cls, directory=CLIMOS_DIR):
+        station_ids, tables = [], []
+        for path in sorted(glob.glob(os.path.join(directory, "*_climatology.csv"))):
+            station_id = normalize_station_id(os.path.basename(path).split("_", 1)[0])
+            table = np.full((len(MONTHS), len(CLIMO_VARIABLES)), np.nan)
+            with open(path, newline="") as csv_file:
+                # Column order differs between files, so values are picked by header
+                for row in csv.DictReader(csv_file):
+                    if row.get("Month") not in MONTHS:
+                        continue
+                    month = MONTHS.index(row["Month"])
+                    for i, variable in enumerate(CLIMO_VARIABLES):
+                        try:
+                            table[month, i] = float(row[variable])
+                        except (KeyError, TypeError, ValueError):
+                            pass
+            station_ids.append(station_id)
+            tables.append(table)
+        return cls(station_ids, np.array(tables).reshape(len(station_ids), len(MONTHS), len(CLIMO_VARIABLES)))
+
+    @classmethod
+    def from_json(cls, path=BUNDLE_PATH):
+        with open(path) as bundle_file:
+            bundle = json.load(bundle_file)
+        values = np.array([[[np.nan if v is None else v for v in month] for month in station] for station in bundle["values"]])
+        return cls(bundle["stations"], values.reshape(len(bundle["stations"]), len(MONTHS), len(bundle["variables"])), bundle["variables"])
+
+    def to_json(self):
+        values = [[[None if np.isnan(v) else round(float(v), 2) for v in month] for month in station] for station in self.values]
+        return {"stations": self.station_ids, "months": MONTHS, "variables": self.variables, "values": values}
+
+    def lookup(self, station_id, month, variable):
+        # One normal, or None if the station or value is unknown; month is 1-12
+        i = self.station_index.get(normalize_station_id(station_id))
+        if i is None:
+            return None
+        value = self.values[i, month - 1, self.variable_index[variable]]
+        return None if np.isnan(value) else float(value)
+
+    def normals(self, station_ids, months, variable):
+        # Vectorized lookup: one normal per (station, month) pair, NaN where unknown
+        rows = np.array([self.station_index.get(normalize_station_id(s), -1) for s in station_ids], dtype=int)
+        months = np.asarray(months, dtype=int)
+        if not len(rows) or not self.station_ids:
+            return np.full(len(rows), np.nan)
+        result = self.values[rows, months - 1, self.variable_index[variable]]
+        return np.where(rows >= 0, result, np.nan)
+
+
+def load_bundle(path=BUNDLE_PATH, directory=CLIMOS_DIR):
+    # The compiled bundle when it exists, otherwise compiled on the fly from the CSVs
+    if os.path.exists(path):
+        return ClimatologyBundle.from_json(path)
+    return ClimatologyBundle.from_csv_dir(directory)
+
+
+def local_months(timestamps):
+    # Month (1-12) in Hawaii time of each ISO timestamp
+    return [datetime.fromisoformat(t.replace("Z", "+00:00")).astimezone(HST).month for t in timestamps]
+
+
+def days_in_months(timestamps):
+    local = [datetime.fromisoformat(t.replace("Z", "+00:00")).astimezone(HST) for t in timestamps]
+    return np.array([calendar.monthrange(d.year, d.month)[1] for d in local], dtype=float)
+
+
+def compute_anomalies(bundle, tair, rainfall_24h):
+    """Latest air temperature and 24-hour rainfall against the station's normal for the month.
+
+    tair and rainfall_24h are the data map products, {station_id: {"value", "timestamp"}}.
+    Temperature is compared with the monthly mean (Tmean_c); rainfall with
+    the monthly total spread evenly over the days of the month (RF_mm / days).
+    Returns {output name: {station_id: {"value", "normal", "timestamp"}}}.
+    """
+    anomalies = {}
+    for name, measurements, variable in (
+        ("Tair_1_Avg_anomaly", tair, "Tmean_c"),
+        ("RF_1_Tot300s_24H_anomaly", rainfall_24h, "RF_mm")
+    ):
+        # Only stations with a value and a timestamp take part; the rest come out as nulls
+        present = [sid for sid, data in measurements.items() if data.get("value") is not None and data.get("timestamp")]
+        timestamps = [measurements[sid]["timestamp"] for sid in present]
+        values = np.array([float(measurements[sid]["value"]) for sid in present])
+        normals = bundle.normals(present, local_months(timestamps), variable)
+        if variable == "RF_mm":
+            normals = normals / days_in_months(timestamps)
+        differences = values - normals
+
+        output = {sid: {"value": None, "normal": None, "timestamp": data.get("timestamp")} for sid, data in measurements.items()}
+        for sid, normal, difference in zip(present, normals, differences):
+            if not np.isnan(normal):
+                output[sid]["value"] = round(float(difference), 2)
+                output[sid]["normal"] = round(float(normal), 2)
+        anomalies[name] = output
+    return anomalies
+
+
+def save_anomalies(anomalies, writer):
+    for name, values in anomalies.items():
+        writer.write_json(f"{name}.json", values)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile public/climos/*.csv into one climatology bundle")
+    parser.add_argument("--climos", default=CLIMOS_DIR, help="directory of NNNN_climatology.csv files")
+    parser.add_argument("--output", default=BUNDLE_PATH)
+    args = parser.parse_args()
+
+    bundle = ClimatologyBundle.from_csv_dir(args.climos)
+    with open(args.output, "w") as bundle_file:
+        json.dump(bundle.to_json(), bundle_file, separators=(",", ":"))
+    print(f"Saved {args.output} ({len(bundle.station_ids)} stations)")
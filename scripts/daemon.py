@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+from hcdp import FetchEngine, DEFAULT_CONCURRENCY
+from metrics import RunMetrics
+from pipeline import WRITE_SNAPSHOT, fetch_all, fetch_stations, publish
+from scheduler import CircuitBreaker
+
+# Optional long-running mode: one process, one pooled session, every job on its own interval.
+# Jobs that fall due together share a single fetch, exactly like a combined pipeline run.
+
+# Job name -> (stages, seconds between runs); the names double as run names, so output files match the workflows
+JOBS = {
+    "datamap": (["datamap", "wind", "rainfall", "anomalies", "grids"], 15 * 60),
+    "diagnostics": (["diagnostics", "aggregates"], 60 * 60),
+    "latest": (["latest"], 60 * 60)
+}
+
+STATIONS_REFRESH = 60 * 60  # seconds the in-memory station list is reused
+DEADLINE_FRACTION = 0.8  # a cycle may use this share of the shortest due job's interval
+
+
+class Daemon:
+    def __init__(self, jobs=JOBS, concurrency=DEFAULT_CONCURRENCY, write_snapshot=WRITE_SNAPSHOT):
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.write_snapshot = write_snapshot
+        self.breaker = CircuitBreaker(os.getenv("CIRCUIT_STATE", "daemon_circuit_state.json"))
+        self.stations = None
+        self.stations_at = None
+        self.next_due = {}
+
+    async def current_stations(self, engine, metrics):
+        if self.stations_at is None or time.monotonic() - self.stations_at > STATIONS_REFRESH:
+            engine.start_run(metrics=metrics)
+            stations = await fetch_stations(engine)
+            # Keep the previous list if the refresh failed
+            if stations or self.stations is None:
+                self.stations = stations
+                self.stations_at = time.monotonic()
+        return self.stations
+
+    async def run_cycle(self, engine, due):
+        stages = list(dict.fromkeys(stage for name in due for stage in self.jobs[name][0]))
+        deadline = min(self.jobs[name][1] for name in due) * DEADLINE_FRACTION
+        print(f"Running {', '.join(due)} (stages {', '.join(stages)})")
+
+        self.breaker.now = datetime.now(timezone.utc)
+        metrics = RunMetrics()
+        stations = await self.current_stations(engine, metrics)
+        fetched = await fetch_all(stages, deadline=deadline, breaker=self.breaker, metrics=metrics, engine=engine, stations=stations)
+        self.breaker.save()
+
+        for name in due:
+            publish(self.jobs[name][0], fetched, name, metrics, self.write_snapshot)
+
+    async def run(self, cycles=None):
+        async with FetchEngine(self.concurrency) as engine:
+            start = time.monotonic()
+            self.next_due = {name: start for name in self.jobs}
+            completed = 0
+            while cycles is None or completed < cycles:
+                now = time.monotonic()
+                due = [name for name, due_at in self.next_due.items() if due_at <= now]
+                if due:
+                    try:
+                        await self.run_cycle(engine, due)
+                    except Exception as e:
+                        # One bad cycle must not take the daemon down; the jobs simply run again next interval
+                        print(f"Cycle for {', '.join(due)} failed: {e!r}")
+                    for name in due:
+                        interval = self.jobs[name][1]
+                        # Skip runs missed while a long cycle was in progress rather than bunching them up
+                        while self.next_due[name] <= time.monotonic():
+                            self.next_due[name] += interval
+                    completed += 1
+                    continue
+                await asyncio.sleep(min(self.next_due.values()) - now)
+
+
+def parse_jobs(names, intervals):
+    jobs = dict(JOBS)
+    for value in intervals or []:
+        name, _, seconds = value.partition("=")
+        if name not in jobs or not seconds:
+            raise ValueError(f"expected JOB=SECONDS with JOB one of {', '.join(JOBS)}, got {value!r}")
+        jobs[name] = (jobs[name][0], float(seconds))
+    if names:
+        unknown = [name for name in names.split(",") if name not in jobs]
+        if unknown:
+            raise ValueError(f"unknown job(s): {', '.join(unknown)} (choose from {', '.join(JOBS)})")
+        jobs = {name: jobs[name] for name in names.split(",")}
+    return jobs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the mesonet jobs on their own intervals in one long-lived process")
+    parser.add_argument("--interval", action="append", metavar="JOB=SECONDS", help=f"override a job's interval ({', '.join(JOBS)})")
+    parser.add_argument("--jobs", help="comma-separated subset of jobs to run (default: all)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="maximum requests in flight")
+    parser.add_argument("--cycles", type=int, help="stop after this many cycles (default: run forever)")
+    parser.add_argument("--snapshot", action="store_true", default=WRITE_SNAPSHOT, help="also write each job's compact snapshot")
+    args = parser.parse_args()
+
+    try:
+        jobs = parse_jobs(args.jobs, args.interval)
+    except ValueError as e:
+        parser.error(str(e))
+    asyncio.run(Daemon(jobs, args.concurrency, args.snapshot).run(args.cycles))
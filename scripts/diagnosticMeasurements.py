@@ -1,154 +1,206 @@
-import requests
-import json
-from datetime import datetime, timedelta, timezone
-import os 
-import pandas as pd
-import time
-
-API_TOKEN = os.getenv("API_TOKEN")
-
-header = {
-    "Authorization": f"Bearer {API_TOKEN}",
-    "Content-Type": "application/json"
-}
+from collections import deque
 
-stations_url = "https://api.hcdp.ikewai.org/mesonet/db/stations"
-measurements_url = "https://api.hcdp.ikewai.org/mesonet/db/measurements"
+import pandas as pd
 
-now = datetime.now(timezone.utc)
-start_time = now - timedelta(hours=24)
-start_time_str = start_time.strftime("%Y-%m-%dT%H:%M:%SZ")  # Convert to API format
+from qc import FLATLINE_SAMPLES, SeriesQc
+from rainfall import parse_timestamp
+from streaming import to_number
 
-# Fetch station data
-try:
-    response = requests.get(stations_url, headers=header, timeout=10)
-    time.sleep(0.2)
-    response.raise_for_status()  # Raises an HTTPError for bad responses
-    stations = response.json()
-except requests.exceptions.RequestException as e:
-    print(f"Error fetching stations: {e}")
-    stations = []
+# Diagnostic products: battery, enclosure humidity, cell signal and paired-sensor differences over 24 hours
 
 variables = ["BattVolt", "RHenc", "CellStr", "CellQlt"]
-measurements_by_variable = {
-    "BattVolt": {},
-    "RHenc_50": {},   # % time RHenc > 80
-    "RHenc_max": {},  # max RHenc
-    "CellStr": {},
-    "CellQlt": {}
-}
-
-
-# Fetch measurements
-for station in stations:
-    station_id = station.get("station_id")
-    
-    for variable in variables:
-        query = f"station_ids={station_id}&var_ids={variable}&start_date={start_time_str}"
-        url = f"{measurements_url}?{query}"
-
-        try:
-            response = requests.get(url, headers=header, timeout=10)
-            time.sleep(2)
-            data = response.json()
-            if not data:
-                continue
-            values = [entry["value"] for entry in data if entry.get("value") is not None]
-
-            if values:
-                if variable == "BattVolt":
-                    result_value = min(values)  # Get min for BattVolt
-                elif variable == "RHenc":
-                    above_50 = [float(v) for v in values if float(v) > 50]
-                    percent_above_50 = (len(above_50) / len(values)) * 100 if values else 0
-
-                    max_rh = max([float(v) for v in values])
-                    latest_timestamp = max(entry["timestamp"] for entry in data if "timestamp" in entry)
-
-                    measurements_by_variable["RHenc_50"][station_id] = {
-                        "value": percent_above_50,
-                        "timestamp": latest_timestamp
-                    }
-
-                    measurements_by_variable["RHenc_max"][station_id] = {
-                        "value": max_rh,
-                        "timestamp": latest_timestamp
-                    }
-
-                    continue
-
-                else:
-                    result_value = max(values)  # Get max for other variables
-
-                latest_timestamp = max(entry["timestamp"] for entry in data if "timestamp" in entry)
-
-                measurements_by_variable[variable][station_id] = {
-                    "value": result_value,
-                    "timestamp": latest_timestamp
-                }
-
-        except requests.exceptions.Timeout:
-            print(f"Timeout for {variable} at station {station_id}")
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching {variable} at station {station_id}: {e}")
-
-# Process special case for stations 0520 and 0521
-station_0520 = "0520"
-station_0521 = "0521"
-
-for variable in ["BattVolt", "CellStr", "CellQlt","RHenc_50", "RHenc_max"]:
-    if station_0520 in measurements_by_variable[variable] and station_0521 in measurements_by_variable[variable]:
-        #Get the min BattVolt value between the two stations
-        if variable == "BattVolt":
-            val_0520 = float(measurements_by_variable[variable][station_0520]["value"])
-            val_0521 = float(measurements_by_variable[variable][station_0521]["value"])
-            measurements_by_variable[variable][station_0521]["value"] = min(val_0520, val_0521)
-        else:  # CellStr and CellQlt
-            measurements_by_variable[variable][station_0521] = measurements_by_variable[variable][station_0520].copy()
-
-    
 var_pairs = [('Tair_1_Avg', 'Tair_2_Avg', 'Tair'), ('RH_1_Avg', 'RH_2_Avg','RH')]
-diff_vars = ["Tair","RH"]
-measurements_by_vardiff = {var: {} for var in diff_vars}
-for station in stations:
-    station_id = station.get("station_id")
-    for var1, var2, var_name in var_pairs:
-        url = f"https://api.hcdp.ikewai.org/mesonet/db/measurements?station_ids={station_id}&var_ids={var1},{var2}&start_date={start_time_str}"
+pair_variables = [var for var1, var2, _ in var_pairs for var in (var1, var2)]
 
-        response = requests.get(url, headers=header, timeout=10)
-        time.sleep(0.2)
-        data = response.json()
-        if not data:
-            continue
 
-        df = pd.DataFrame(data)
+# Output file -> (aggregate, source variable); every aggregate is kept as a running value while rows stream in
+DIAGNOSTIC_OUTPUTS = {
+    "BattVolt": ("min", "BattVolt"),
+    "RHenc_50": ("above_50", "RHenc"),   # % time RHenc > 50
+    "RHenc_max": ("max", "RHenc"),       # max RHenc
+    "CellStr": ("max", "CellStr"),
+    "CellQlt": ("max", "CellQlt")
+}
 
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
+# Rows kept per series for the quality control of its newest value: enough for the flatline test
+RECENT_ROWS = max(FLATLINE_SAMPLES.values())
+
+# Pair variable -> (pair name, sensor index)
+PAIR_SENSORS = {var: (var_name, i) for var1, var2, var_name in var_pairs for i, var in enumerate((var1, var2))}
+PAIR_VARIABLES = {var_name: (var1, var2) for var1, var2, var_name in var_pairs}
+
+
+class SeriesStats:
+    # Running aggregates of one (station, diagnostic variable) series
+    def __init__(self):
+        self.min = None
+        self.max = None
+        self.count = 0
+        self.above_50 = 0
+        self.timestamp = None
+
+    def add(self, timestamp, value):
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.count += 1
+        self.above_50 += value > 50
+        self.timestamp = timestamp if self.timestamp is None else max(self.timestamp, timestamp)
+
+    def get(self, stat):
+        return self.above_50 / self.count * 100 if stat == "above_50" else getattr(self, stat)
+
+
+class PairStats:
+    """Running mean |sensor 1 - sensor 2| of one (station, pair) and the qc flags of both sensors.
+
+    Each sensor's rows arrive newest first; a usable reading waits in
+    `pending` until the other sensor reaches its timestamp, and is dropped
+    once the other sensor has gone past it without a usable reading there.
+    """
+
+    def __init__(self, var_name):
+        self.qc = tuple(SeriesQc(variable) for variable in PAIR_VARIABLES[var_name])
+        self.pending = (deque(), deque())  # (time, value) of each sensor, newest first
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, sensor, time, value):
+        value = self.qc[sensor].add(time, value)
+        other = self.pending[1 - sensor]
+        while other and other[0][0] > time:
+            other.popleft()
+        if value is None:
+            return
+        if other and other[0][0] == time:
+            self.total += abs(value - other.popleft()[1])
+            self.count += 1
+        else:
+            self.pending[sensor].append((time, value))
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def flags(self):
+        return self.qc[0].flags() | self.qc[1].flags()
+
+
+class DiagnosticAccumulator:
+    """Consumes measurement rows one at a time and keeps only running aggregates.
+
+    Rows arrive once each and newest first within each series, as
+    stream_series() and the series store hand them out. Paired sensor rows
+    are folded into a PairStats per (station, pair), so memory does not grow
+    with the window. `recent` holds the newest RECENT_ROWS rows of every
+    series, diagnostics or not, newest first.
+    """
+
+    def __init__(self):
+        self.recent = {}
+        self.stats = {}
+        self.pairs = {}
+
+    def add(self, entry):
+        key = (entry["station_id"], entry["variable"])
+        timestamp = entry["timestamp"]
+        recent = self.recent.setdefault(key, [])
+        if len(recent) < RECENT_ROWS:
+            recent.append(entry)
+
+        value = to_number(entry.get("value"))
+        if key[1] in PAIR_SENSORS:
+            var_name, sensor = PAIR_SENSORS[key[1]]
+            pair = self.pairs.get((key[0], var_name))
+            if pair is None:
+                pair = self.pairs[(key[0], var_name)] = PairStats(var_name)
+            pair.add(sensor, int(parse_timestamp(timestamp).timestamp()), value)
+            return
+        if value is not None and key[1] in variables:
+            self.stats.setdefault(key, SeriesStats()).add(timestamp, value)
+
+    def metrics(self):
+        # One row per station with any diagnostic readings: each output value and its timestamp
+        records = {}
+        for (station_id, variable), stats in self.stats.items():
+            record = records.setdefault(station_id, {})
+            for name, (stat, source) in DIAGNOSTIC_OUTPUTS.items():
+                if source == variable:
+                    record[name] = float(stats.get(stat))
+                    record[f"{name}_timestamp"] = stats.timestamp
+        columns = [column for name in DIAGNOSTIC_OUTPUTS for column in (name, f"{name}_timestamp")]
+        return pd.DataFrame.from_dict(records, orient="index", columns=columns).sort_index()
+
+    def pair_diffs(self):
+        """Mean |sensor1 - sensor2| per station over the timestamps both sensors reported.
+
+        Readings that fail the range test are left out, and the "<pair>_qc"
+        column holds the OR of both sensors' flags over the window.
+        """
+        records = {}
+        for (station_id, var_name), pair in self.pairs.items():
+            record = records.setdefault(station_id, {})
+            record[var_name] = pair.mean()
+            record[f"{var_name}_qc"] = pair.flags()
+        names = [var_name for _, _, var_name in var_pairs]
+        columns = names + [f"{name}_qc" for name in names]
+        diffs = pd.DataFrame.from_dict(records, orient="index", columns=columns, dtype=float)
+        diffs.index.name = "station_id"
+        return diffs.sort_index()
+
+
+def merge_station_0520(metrics):
+    # Stations 0520 and 0521 share a site: 0521 reports the lower battery of the two and 0520's other diagnostics
+    if "0520" not in metrics.index or "0521" not in metrics.index:
+        return metrics
+    names = list(DIAGNOSTIC_OUTPUTS)
+    both = metrics.loc[["0520", "0521"], names].notna().all()
+
+    copied = [name for name in names if both[name] and name != "BattVolt"]
+    columns = copied + [f"{name}_timestamp" for name in copied]
+    metrics.loc["0521", columns] = metrics.loc["0520", columns]
+    if both["BattVolt"]:
+        metrics.loc["0521", "BattVolt"] = metrics.loc[["0520", "0521"], "BattVolt"].min()
+    return metrics
+
+
+def build_diagnostics(stations, accumulator):
+    # accumulator is a DiagnosticAccumulator fed every row of the last 24 hours
+    metrics = merge_station_0520(accumulator.metrics())
+    diffs = accumulator.pair_diffs()
+
+    # Convert back to the per-station JSON layout in station order
+    order = [station.get("station_id") for station in stations]
+    metrics = metrics.reindex([sid for sid in order if sid in metrics.index])
+    diffs = diffs.reindex([sid for sid in order if sid in diffs.index])
+
+    measurements_by_variable = {
+        name: {
+            sid: {"value": float(value), "timestamp": timestamp}
+            for sid, value, timestamp in zip(metrics.index, metrics[name], metrics[f"{name}_timestamp"])
+            if pd.notna(value)
+        }
+        for name in DIAGNOSTIC_OUTPUTS
+    }
+    measurements_by_vardiff = {
+        var_name: {
+            sid: {"value": float(value), "qc": int(qc)}
+            for sid, value, qc in zip(diffs.index, diffs[var_name], diffs[f"{var_name}_qc"])
+            if pd.notna(value)
+        }
+        for _, _, var_name in var_pairs
+    }
+    return measurements_by_variable, measurements_by_vardiff
 
-        pivot_df = df.pivot(index='timestamp', columns='variable', values='value').sort_index()
-        pivot_df = pivot_df.astype(float)
 
-        # Skip if either variable is missing
-        if var1 not in pivot_df.columns or var2 not in pivot_df.columns:
-            continue
+def save_diagnostics(measurements_by_variable, measurements_by_vardiff, writer):
+    for variable, measurements in measurements_by_variable.items():
+        writer.write_json(f"{variable}.json", measurements)
 
-        pivot_df[f'{var_name}_diff'] = (pivot_df[f'{var1}'] - pivot_df[f'{var2}']).abs()
-        diff_mean = pivot_df[f'{var_name}_diff'].mean()
+    # Save sensor difference files: Tair_diff.json and RH_diff.json
+    for variable, measurements in measurements_by_vardiff.items():
+        writer.write_json(f"{variable}_diff.json", measurements)
 
-        measurements_by_vardiff[var_name][station_id] = {
-            "value": diff_mean
-        }
 
-        
-for variable, measurements in measurements_by_variable.items():
-    filename = f"{variable}.json"
-    with open(filename, "w") as json_file:
-        json.dump(measurements, json_file, indent=4)
-    print(f"Saved {filename}")
-
-# Save sensor difference files: Tair_diff.json and RH_diff.json
-for variable, measurements in measurements_by_vardiff.items():
-    filename = f"{variable}_diff.json"
-    with open(filename, "w") as json_file:
-        json.dump(measurements, json_file, indent=4)
-    print(f"Saved {filename}")
+if __name__ == "__main__":
+    from pipeline import run_pipeline
+    # The 7-day aggregates change little between runs, so they are refreshed hourly with the diagnostics, sharing its series store
+    run_pipeline(["diagnostics", "aggregates"], run_name="diagnostics")
@@ -0,0 +1,161 @@
+import math
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # falls back to a brute-force nearest-neighbour search, fine for a few hundred stations
+    cKDTree = None
+
+# Gridded layers for the data map and wind map: station values interpolated onto a fixed island grid
+# by inverse-distance weighting, quantized to 16 bits and written as one small binary file per variable
+
+# Grid covering the main Hawaiian islands, cell centres every GRID_STEP degrees, rows north to south
+GRID_LAT = (18.85, 22.35)
+GRID_LON = (-160.30, -154.75)
+GRID_STEP = 0.02
+
+NEIGHBOURS = 8  # stations weighted per cell
+POWER = 2  # inverse-distance exponent
+MAX_DISTANCE_KM = 30  # cells with no station this close are left empty
+
+NODATA = 65535  # quantized value of an empty cell; real values use 0..65534
+KM_PER_DEGREE = 111.2
+
+# Point variables that are interpolated; wind speed and direction become u/v components instead
+GRID_VARIABLES = ["Tair_1_Avg", "SM_1_Avg", "RH_1_Avg", "SWin_1_Avg", "Tsoil_1_Avg"]
+
+
+def grid_axes():
+    lats = np.arange(GRID_LAT[1], GRID_LAT[0] - GRID_STEP / 2, -GRID_STEP)
+    lons = np.arange(GRID_LON[0], GRID_LON[1] + GRID_STEP / 2, GRID_STEP)
+    return lats, lons
+
+
+def project(lats, lons):
+    # Equirectangular kilometres around the grid's mean latitude; distortion is negligible at this scale
+    scale = math.cos(math.radians(sum(GRID_LAT) / 2))
+    return np.column_stack([np.asarray(lons) * KM_PER_DEGREE * scale, np.asarray(lats) * KM_PER_DEGREE])
+
+
+def nearest(points, cells, k):
+    # (distances, indices) of the k nearest points to every cell, both shaped (cells, k)
+    k = min(k, len(points))
+    if cKDTree is not None:
+        distances, indices = cKDTree(points).query(cells, k=k)
+        return distances.reshape(len(cells), k), indices.reshape(len(cells), k)
+    # Blocks of cells keep the cells x stations distance matrix small
+    chunks = []
+    for block in np.array_split(cells, max(1, len(cells) // 8192)):
+        distances = np.hypot(block[:, None, 0] - points[None, :, 0], block[:, None, 1] - points[None, :, 1])
+        indices = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        chunks.append((np.take_along_axis(distances, indices, axis=1), indices))
+    return np.concatenate([d for d, _ in chunks]), np.concatenate([i for _, i in chunks])
+
+
+class Interpolator:
+    """Inverse-distance weights from the stations to every grid cell.
+
+    The neighbour search depends only on which stations report, so it is
+    done once per station set and shared by every variable those stations
+    cover.
+    """
+
+    def __init__(self, lats, lons):
+        grid_lats, grid_lons = grid_axes()
+        self.shape = (len(grid_lats), len(grid_lons))
+        mesh_lons, mesh_lats = np.meshgrid(grid_lons, grid_lats)
+        distances, self.indices = nearest(project(lats, lons), project(mesh_lats.ravel(), mesh_lons.ravel()), NEIGHBOURS)
+
+        # A cell on top of a station takes that station's value
+        weights = 1 / np.maximum(distances, 1e-6) ** POWER
+        weights[distances > MAX_DISTANCE_KM] = 0
+        totals = weights.sum(axis=1, keepdims=True)
+        self.empty = totals[:, 0] == 0
+        self.weights = np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+
+    def interpolate(self, values):
+        grid = (self.weights * np.asarray(values, dtype=float)[self.indices]).sum(axis=1)
+        grid[self.empty] = np.nan
+        return grid.reshape(self.shape)
+
+
+def wind_components(speed, direction):
+    # Meteorological direction is where the wind blows from; u points east and v north
+    radians = np.radians(direction)
+    return -speed * np.sin(radians), -speed * np.cos(radians)
+
+
+def quantize(grid):
+    # (uint16 cells, offset, scale) with value = offset + cell * scale; NaN cells become NODATA
+    valid = grid[~np.isnan(grid)]
+    if valid.size == 0:
+        return np.full(grid.shape, NODATA, dtype="<u2"), None, None
+    offset, top = float(valid.min()), float(valid.max())
+    scale = (top - offset) / (NODATA - 1) or 1.0
+    cells = np.where(np.isnan(grid), NODATA, np.round((np.nan_to_num(grid, nan=offset) - offset) / scale))
+    return cells.astype("<u2"), offset, scale
+
+
+def station_points(stations, values):
+    # (lats, lons, values) for stations with coordinates and a numeric value
+    coordinates = {s["station_id"]: (s.get("lat"), s.get("lng")) for s in stations}
+    points = [
+        (float(coordinates[sid][0]), float(coordinates[sid][1]), float(value))
+        for sid, value in values.items()
+        if value is not None and sid in coordinates and None not in coordinates[sid]
+    ]
+    return tuple(np.array(column) for column in zip(*points)) if points else (np.empty(0),) * 3
+
+
+def build_grids(stations, measurements_by_variable, wind_data, rainfall=None):
+    """{layer name: float grid} from the data map products.
+
+    Station sets differ between variables, so interpolators are cached by
+    the set of stations that report.
+    """
+    layers = {name: {sid: data["value"] for sid, data in measurements_by_variable.get(name, {}).items()} for name in GRID_VARIABLES}
+    if rainfall:
+        layers["RF_1_Tot300s_24H"] = {sid: data["value"] for sid, data in rainfall.items()}
+
+    # Only stations whose speed and direction share a timestamp made it into wind.json with values
+    speeds = {sid: data["value_WS"] for sid, data in wind_data.items() if data["value_WS"] not in (None, "None")}
+    directions = {sid: data["value_WDrs"] for sid, data in wind_data.items() if data["value_WDrs"] not in (None, "None")}
+    wind_ids = [sid for sid in speeds if sid in directions]
+    u, v = wind_components(
+        np.array([float(speeds[sid]) for sid in wind_ids]), np.array([float(directions[sid]) for sid in wind_ids])
+    )
+    layers["wind_u"] = dict(zip(wind_ids, u))
+    layers["wind_v"] = dict(zip(wind_ids, v))
+
+    interpolators = {}
+    grids = {}
+    for name, values in layers.items():
+        lats, lons, points = station_points(stations, values)
+        if len(points) == 0:
+            continue
+        key = (tuple(lats), tuple(lons))
+        if key not in interpolators:
+            interpolators[key] = Interpolator(lats, lons)
+        grids[name] = interpolators[key].interpolate(points)
+    return grids
+
+
+def save_grids(grids, writer):
+    # grid_<layer>.bin holds little-endian uint16 cells row by row from the north-west corner; grids.json describes them
+    lats, lons = grid_axes()
+    index = {
+        "rows": len(lats),
+        "columns": len(lons),
+        "north": round(float(lats[0]), 4),
+        "west": round(float(lons[0]), 4),
+        "step": GRID_STEP,
+        "nodata": NODATA,
+        "layers": {}
+    }
+    for name, grid in grids.items():
+        cells, offset, scale = quantize(grid)
+        filename = f"grid_{name}.bin"
+        writer.write_bytes(filename, cells.tobytes())
+        index["layers"][name] = {"file": filename, "offset": offset, "scale": scale}
+    writer.write_json("grids.json", index)
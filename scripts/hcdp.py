@@ -0,0 +1,278 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+from urllib.parse import parse_qs, urlparse
+
+import aiohttp
+
+from http_cache import default_cache
+from metrics import RunMetrics
+from ratelimit import AdaptiveRateLimiter, backoff_delay, parse_retry_after
+from scheduler import PRIORITY, DeadlineExceeded, PrioritySemaphore
+from streaming import CHUNK_SIZE, iter_json_array
+
+# Shared HCDP API settings and the async fetch engine used by the data scripts
+
+API_TOKEN = os.getenv("API_TOKEN")
+
+header = {
+    "Authorization": f"Bearer {API_TOKEN}",
+    "Content-Type": "application/json"
+}
+
+# Point HCDP_API_URL at a stand-in server (see mock_hcdp.py) to run the scripts offline
+API_URL = os.getenv("HCDP_API_URL", "https://api.hcdp.ikewai.org").rstrip("/")
+
+stations_url = f"{API_URL}/mesonet/db/stations"
+measurements_url = f"{API_URL}/mesonet/db/measurements"
+
+# Maximum number of requests in flight at once (override with HCDP_CONCURRENCY)
+DEFAULT_CONCURRENCY = int(os.getenv("HCDP_CONCURRENCY", "8"))
+
+# Retries for timeouts, 429 and 5xx responses before a request is given up (override with HCDP_MAX_RETRIES)
+MAX_RETRIES = int(os.getenv("HCDP_MAX_RETRIES", "3"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Set of station ids whose requests failed, for callers that need to know which of their own
+# requests failed while other work shares the engine (see track_failures)
+FAILED_STATIONS = contextvars.ContextVar("failed_stations", default=None)
+
+
+async def track_failures(coro):
+    # Runs coro and returns (result, stations whose requests failed in it or anything it spawned)
+    failed = set()
+    token = FAILED_STATIONS.set(failed)
+    try:
+        return await coro, failed
+    finally:
+        FAILED_STATIONS.reset(token)
+
+
+def deliver(data, consume):
+    # A buffered body handed out the way a streamed one would be
+    if consume is None or not isinstance(data, list):
+        return data
+    for row in data:
+        consume(row)
+    return len(data)
+
+
+class FetchEngine:
+    """Async HTTP client that shares one pooled keep-alive session.
+
+    At most `concurrency` requests run at the same time, so total run time is
+    bounded by the concurrency budget rather than the number of stations.
+    Requests also pass through an adaptive rate limiter and are retried with
+    jittered exponential backoff when the API times out or pushes back.
+
+    With a `deadline` (seconds from entering the engine) no request outlives
+    the run budget: timeouts and backoff are clipped to the time left and
+    requests after the deadline fail immediately with DeadlineExceeded.
+    Free slots go to the highest-priority waiting request (see scheduler.py).
+    Stations whose requests failed are collected in `incomplete` (and,
+    per task, by track_failures), and an optional CircuitBreaker is told
+    about every station a request covered: a success clears it, a failure
+    counts against it at most once per run (a batch that failed and was
+    split is not charged again at every level).
+
+    Responses go through the shared on-disk cache (see http_cache.py): a
+    fresh entry is returned without touching the network, and a stale one
+    is revalidated with If-None-Match / If-Modified-Since. Pass cache=False
+    for a run that should neither read nor fill the cache.
+
+    Every attempt, retry, cache hit and wait is recorded in `metrics`
+    (a RunMetrics, see metrics.py) for the run summary.
+
+    get_json(url, consume=fn) streams instead: each element of the JSON
+    array is passed to fn as it is decoded, and the element count is
+    returned. Only the raw bytes are kept, for the cache, never the decoded
+    rows. A retry after a partial read passes the first elements again.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, limiter=None, max_retries=MAX_RETRIES, deadline=None, breaker=None, cache=None, metrics=None):
+        self.concurrency = concurrency
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.breaker = breaker
+        # cache=None uses the shared default cache, cache=False runs without one
+        self.cache = default_cache() if cache is None else cache or None
+        self.metrics = metrics or RunMetrics()
+        self.ends_at = None
+        self.incomplete = set()
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(headers=header, connector=connector)
+        self.semaphore = PrioritySemaphore(self.concurrency)
+        self.start_run(self.deadline, self.breaker, self.metrics)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def start_run(self, deadline=None, breaker=None, metrics=None):
+        # Resets the per-run state, so one long-lived engine (and its warm connections) can serve many runs
+        self.deadline = deadline
+        self.breaker = breaker
+        self.metrics = metrics or RunMetrics()
+        self.ends_at = None if deadline is None else time.monotonic() + deadline
+        self.incomplete = set()
+        self.charged = set()
+
+    def remaining(self):
+        return None if self.ends_at is None else self.ends_at - time.monotonic()
+
+    def expired(self):
+        return self.ends_at is not None and time.monotonic() >= self.ends_at
+
+    def _mark_incomplete(self, station_ids):
+        self.incomplete.update(station_ids)
+        failed = FAILED_STATIONS.get()
+        if failed is not None:
+            failed.update(station_ids)
+
+    def _record_success(self, station_ids):
+        if self.breaker is not None:
+            for station_id in station_ids:
+                self.breaker.record_success(station_id)
+
+    def _fail(self, station_ids):
+        # A request given up on; running out of run time says nothing about the stations, so the breaker is left alone
+        self._mark_incomplete(station_ids)
+        if self.breaker is not None and not self.expired():
+            for station_id in station_ids:
+                if station_id not in self.charged:
+                    self.charged.add(station_id)
+                    self.breaker.record_failure(station_id)
+
+    def _check_deadline(self, url, station_ids):
+        if self.expired():
+            self._mark_incomplete(station_ids)
+            raise DeadlineExceeded(f"Run deadline reached before {url}")
+
+    def _invalid_body(self, url, station_ids, started, error):
+        # A 200 whose body is not the JSON expected (an error object, or cut short): a failed request, not retried
+        self.metrics.request(url, station_ids, "invalid", time.monotonic() - started)
+        print(f"Invalid response for {url}: {error}")
+        self._fail(station_ids)
+        return None
+
+    async def _read_chunks(self, response, chunks):
+        # Passes the body through in chunks, keeping a copy of the bytes when there is a cache to fill
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            if self.cache is not None:
+                chunks.append(chunk)
+            yield chunk
+
+    async def get_json(self, url, timeout=10, consume=None, cached=True):
+        # Returns the decoded body (or the element count with `consume`), or None for a non-200 response.
+        # Raises asyncio.TimeoutError once retries are exhausted so callers can skip work like the old requests code did.
+        # cached=False skips the cache lookup (the response is still stored).
+        station_ids = [s for s in parse_qs(urlparse(url).query).get("station_ids", [""])[0].split(",") if s]
+
+        validators = {}
+        if self.cache is not None and cached:
+            body, validators = self.cache.lookup(url)
+            if body is not None:
+                print(f"{url} (cached)")
+                self.metrics.cache_hit()
+                with self.metrics.timer("parsing"):
+                    return deliver(json.loads(body), consume)
+
+        for attempt in range(self.max_retries + 1):
+            last_try = attempt == self.max_retries
+            self._check_deadline(url, station_ids)
+            with self.metrics.timer("rate_limited"):
+                await self.limiter.acquire()
+            queued = time.perf_counter()
+            async with self.semaphore.slot(PRIORITY.get()):
+                self.metrics.add_time("queued", time.perf_counter() - queued)
+                self._check_deadline(url, station_ids)
+                remaining = self.remaining()
+                request_timeout = timeout if remaining is None else min(timeout, remaining)
+                print(url)
+                started = time.monotonic()
+                try:
+                    async with self.session.get(url, headers=validators, timeout=aiohttp.ClientTimeout(total=request_timeout)) as response:
+                        if response.status == 304 and self.cache is not None:
+                            # Unchanged since the cached copy: only the headers crossed the network
+                            self.limiter.on_success(time.monotonic() - started)
+                            self.metrics.request(url, station_ids, 304, time.monotonic() - started)
+                            body = self.cache.cached_body(url)
+                            if body is None:
+                                # Evicted by another request's store() while this one was in flight
+                                break
+                            self.cache.touch(url, revalidated=True)
+                            with self.metrics.timer("parsing"):
+                                return deliver(json.loads(body), consume)
+                        if response.status in RETRY_STATUSES and not last_try:
+                            self.limiter.on_pushback(parse_retry_after(response.headers.get("Retry-After")))
+                            self.metrics.request(url, station_ids, response.status, time.monotonic() - started)
+                            self.metrics.retry()
+                            print(f"HTTP {response.status} for {url}, retrying")
+                        elif response.status != 200:
+                            self.metrics.request(url, station_ids, response.status, time.monotonic() - started)
+                            self._fail(station_ids)
+                            return None
+                        elif consume is not None:
+                            # Rows are aggregated while the rest of the body is still in transit
+                            count = 0
+                            chunks = []
+                            try:
+                                async for row in iter_json_array(self._read_chunks(response, chunks)):
+                                    consume(row)
+                                    count += 1
+                            except ValueError as e:
+                                return self._invalid_body(url, station_ids, started, e)
+                            self.metrics.request(url, station_ids, 200, time.monotonic() - started, response.content.total_bytes)
+                            if self.cache is not None:
+                                self.cache.store(url, b"".join(chunks), response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                            self.limiter.on_success(time.monotonic() - started)
+                            self._record_success(station_ids)
+                            return count
+                        else:
+                            body = await response.read()
+                            try:
+                                with self.metrics.timer("parsing"):
+                                    data = json.loads(body)
+                            except ValueError as e:
+                                return self._invalid_body(url, station_ids, started, e)
+                            self.metrics.request(url, station_ids, 200, time.monotonic() - started, len(body))
+                            if self.cache is not None:
+                                self.cache.store(url, body, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                            self.limiter.on_success(time.monotonic() - started)
+                            self._record_success(station_ids)
+                            return data
+                except asyncio.TimeoutError:
+                    self.limiter.on_pushback()
+                    self.metrics.request(url, station_ids, "timeout", time.monotonic() - started)
+                    if last_try or self.expired():
+                        self._fail(station_ids)
+                        raise
+                    print(f"Timed out after {request_timeout:.1f}s: {url}, retrying")
+                    self.metrics.retry()
+                except aiohttp.ClientError as e:
+                    self.metrics.request(url, station_ids, "error", time.monotonic() - started)
+                    if last_try:
+                        print(f"Request failed for {url}: {e}")
+                        self._fail(station_ids)
+                        return None
+                    print(f"Request failed for {url}: {e}, retrying")
+                    self.metrics.retry()
+
+            # Back off outside the slot so other requests can use it meanwhile
+            delay = backoff_delay(attempt)
+            remaining = self.remaining()
+            with self.metrics.timer("backoff"):
+                await asyncio.sleep(delay if remaining is None else max(0, min(delay, remaining)))
+
+        # Only reached when a 304 found its cached body gone: fetch it again in full, without validators
+        print(f"Cached copy of {url} was evicted during revalidation, fetching it again")
+        return await self.get_json(url, timeout, consume, cached=False)
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+# Persistent on-disk response cache shared by every script that goes through FetchEngine
+
+CACHE_PATH = os.getenv("HCDP_CACHE", ".hcdp_cache.sqlite")
+CACHE_MAX_BYTES = int(float(os.getenv("HCDP_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+# Seconds a response is served without asking the API again
+STATIONS_TTL = int(os.getenv("HCDP_STATIONS_TTL", str(24 * 3600)))
+MEASUREMENTS_TTL = int(os.getenv("HCDP_MEASUREMENTS_TTL", "240"))  # just under the 5-minute sample interval
+
+LIST_PARAMS = {"station_ids", "var_ids"}
+
+
+def normalize_url(url):
+    # Same query in any parameter or id order -> same key
+    parts = urlsplit(url)
+    params = []
+    for key, value in parse_qsl(parts.query, keep_blank_values=True):
+        if key in LIST_PARAMS:
+            value = ",".join(sorted(v for v in value.split(",") if v))
+        params.append((key, value))
+    return f"{parts.scheme}://{parts.netloc}{parts.path}?{urlencode(sorted(params), safe=',:')}"
+
+
+def ttl_for(url):
+    path = urlsplit(url).path
+    if path.endswith("/stations"):
+        return STATIONS_TTL
+    return MEASUREMENTS_TTL
+
+
+class ResponseCache:
+    """SQLite-backed response bodies with per-endpoint TTLs and LRU eviction.
+
+    Expired entries are kept (until evicted) so their ETag / Last-Modified
+    validators can turn the next request into a cheap conditional one.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, "
+            "stored_at REAL, accessed_at REAL, size INTEGER)"
+        )
+        self.db.commit()
+
+    def lookup(self, url):
+        # Returns (body or None if stale/missing, validator headers for a conditional request)
+        row = self.db.execute(
+            "SELECT body, etag, last_modified, stored_at FROM responses WHERE key = ?", (normalize_url(url),)
+        ).fetchone()
+        if row is None:
+            return None, {}
+        body, etag, last_modified, stored_at = row
+        if time.time() - stored_at < ttl_for(url):
+            self.touch(url)
+            return body, {}
+        validators = {}
+        if etag:
+            validators["If-None-Match"] = etag
+        if last_modified:
+            validators["If-Modified-Since"] = last_modified
+        return None, validators
+
+    def cached_body(self, url):
+        row = self.db.execute("SELECT body FROM responses WHERE key = ?", (normalize_url(url),)).fetchone()
+        return row[0] if row else None
+
+    def touch(self, url, revalidated=False):
+        now = time.time()
+        if revalidated:
+            self.db.execute("UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?", (now, now, normalize_url(url)))
+        else:
+            self.db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, normalize_url(url)))
+        self.db.commit()
+
+    def store(self, url, body, etag=None, last_modified=None):
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (normalize_url(url), body, etag, last_modified, now, now, len(body))
+        )
+        self.evict()
+        self.db.commit()
+
+    def evict(self):
+        # Least recently used entries go first once the cache is over its size budget
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def close(self):
+        self.db.close()
+
+
+def default_cache():
+    # HCDP_CACHE set to an empty string turns caching off
+    return ResponseCache() if CACHE_PATH else None
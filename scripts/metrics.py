@@ -0,0 +1,118 @@
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+# Per-request instrumentation and the run summary written next to the data products
+
+# Upper bounds (seconds) of the latency histogram buckets; anything slower lands in the last one
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30]
+HISTOGRAM_LABELS = [f"<={bound}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+SLOWEST_STATIONS = 10
+
+
+def endpoint_name(url):
+    return urlparse(url).path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def bucket_label(latency):
+    for bound, label in zip(LATENCY_BUCKETS, HISTOGRAM_LABELS):
+        if latency <= bound:
+            return label
+    return HISTOGRAM_LABELS[-1]
+
+
+class LatencyStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.statuses = {}
+        self.histogram = {}
+
+    def add(self, status, latency, size):
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+        self.bytes += size
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        label = bucket_label(latency)
+        self.histogram[label] = self.histogram.get(label, 0) + 1
+
+    def to_dict(self):
+        return {
+            "requests": self.count,
+            "bytes": self.bytes,
+            "total_seconds": round(self.total, 3),
+            "mean_seconds": round(self.total / self.count, 3) if self.count else None,
+            "max_seconds": round(self.max, 3),
+            "statuses": self.statuses,
+            "histogram": {label: self.histogram[label] for label in HISTOGRAM_LABELS if label in self.histogram}
+        }
+
+
+class RunMetrics:
+    """Counters and timers for one run.
+
+    Every HTTP attempt is recorded against its endpoint and against each
+    station in its query: a slow batch counts toward all its stations, and
+    its bytes are shared equally between them.
+    Phase timers add up time spent waiting on the rate limiter, queued for a
+    request slot, backing off, parsing and writing; request-side phases are
+    summed across concurrent requests, so they can exceed the wall time.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.started_at = datetime.now(timezone.utc)
+        self.endpoints = {}
+        self.stations = {}
+        self.retries = 0
+        self.timeouts = 0
+        self.cache_hits = 0
+        self.phases = {}
+
+    def request(self, url, station_ids, status, latency, size=0):
+        endpoint = endpoint_name(url)
+        self.endpoints.setdefault(endpoint, LatencyStats()).add(status, latency, size)
+        for station_id in station_ids:
+            self.stations.setdefault(station_id, LatencyStats()).add(status, latency, size // len(station_ids))
+        if status == "timeout":
+            self.timeouts += 1
+
+    def retry(self):
+        self.retries += 1
+
+    def cache_hit(self):
+        self.cache_hits += 1
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - started)
+
+    def summary(self, run_name, freshness=None):
+        stations = {station_id: stats.to_dict() for station_id, stats in sorted(self.stations.items())}
+        slowest = sorted(stations, key=lambda station_id: stations[station_id]["max_seconds"], reverse=True)[:SLOWEST_STATIONS]
+        return {
+            "run_name": run_name,
+            "started": self.started_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "duration_seconds": round(time.monotonic() - self.started, 3),
+            "complete": freshness["complete"] if freshness else None,
+            "requests": sum(stats.count for stats in self.endpoints.values()),
+            "bytes": sum(stats.bytes for stats in self.endpoints.values()),
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "cache_hits": self.cache_hits,
+            "phases_seconds": {phase: round(seconds, 3) for phase, seconds in sorted(self.phases.items())},
+            "endpoints": {endpoint: stats.to_dict() for endpoint, stats in sorted(self.endpoints.items())},
+            "slowest_stations": slowest,
+            "stations": stations
+        }
@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+from capabilities import load_capabilities
+
+# Local stand-in for the HCDP mesonet API: synthetic stations and 5-minute measurements,
+# with injectable latency, hung requests and error responses. Run the scripts against it with
+#   HCDP_API_URL=http://localhost:8765 python scripts/datamap.py
+
+DIAGNOSTIC_VARS = ["BattVolt", "RHenc", "CellStr", "CellQlt"]
+
+# Variable -> (low, high) of the synthetic signal
+RANGES = {
+    "Tair_1_Avg": (18, 30), "Tair_2_Avg": (18, 30),
+    "RH_1_Avg": (55, 98), "RH_2_Avg": (55, 98),
+    "SWin_1_Avg": (0, 1000), "SM_1_Avg": (0.1, 0.45), "Tsoil_1_Avg": (19, 27),
+    "WS_1_Avg": (0, 9), "WDrs_1_Avg": (0, 360), "P_1": (95, 101),
+    "RF_1_Tot300s": (0, 1.5), "RF_1_Tot900s": (0, 3),
+    "BattVolt": (12.2, 13.8), "RHenc": (20, 65), "CellStr": (-105, -65), "CellQlt": (-16, -6)
+}
+DEFAULT_RANGE = (0, 100)
+
+# Bounding box of the main Hawaiian islands, for synthetic station coordinates
+LAT_RANGE = (18.9, 22.3)
+LON_RANGE = (-160.3, -154.8)
+
+
+def noise(*parts):
+    # Deterministic 0..1 value for a row, cheap enough for hundreds of thousands of rows
+    return zlib.crc32("|".join(parts).encode()) / 0xFFFFFFFF
+
+
+def synthetic_value(station_id, variable, when):
+    low, high = RANGES.get(variable, DEFAULT_RANGE)
+    jitter = noise(station_id, variable, when.isoformat())
+    if variable.startswith("RF_"):
+        # Mostly dry, with the odd shower
+        return round(high * jitter, 2) if jitter > 0.9 else 0.0
+    diurnal = (math.sin((when.hour + when.minute / 60 - 8) / 24 * 2 * math.pi) + 1) / 2
+    return round(low + (high - low) * (0.8 * diurnal + 0.2 * jitter), 2)
+
+
+class MockApi:
+    def __init__(self, station_count=80, latency=0.05, timeout_rate=0.0, error_rate=0.0, hang=60.0, seed=0):
+        self.latency = latency
+        self.timeout_rate = timeout_rate
+        self.error_rate = error_rate
+        self.hang = hang
+        self.random = random.Random(seed)
+        self.stations, self.station_vars = self.make_stations(station_count)
+        self.reset()
+
+    def make_stations(self, count):
+        # Real station ids and variable lists from station_variables.csv first, then made-up ones
+        index = load_capabilities()
+        ids = sorted(index.station_vars, key=int)[:count]
+        ids += [f"{9000 + i:04d}" for i in range(count - len(ids))]
+        all_vars = sorted(RANGES)
+        stations, station_vars = [], {}
+        for station_id in ids:
+            carried = index.station_vars.get(station_id) or set(all_vars)
+            station_vars[station_id] = carried | set(DIAGNOSTIC_VARS)
+            stations.append({
+                "station_id": station_id,
+                "name": f"Station {station_id}",
+                "lat": round(LAT_RANGE[0] + (LAT_RANGE[1] - LAT_RANGE[0]) * noise(station_id, "lat"), 5),
+                "lng": round(LON_RANGE[0] + (LON_RANGE[1] - LON_RANGE[0]) * noise(station_id, "lng"), 5),
+                "elevation": round(3000 * noise(station_id, "elevation")),
+                "status": "inactive" if noise(station_id, "status") < 0.1 else "active"
+            })
+        return stations, station_vars
+
+    def reset(self):
+        self.stats = {"requests": 0, "bytes": 0, "statuses": {}, "endpoints": {}, "injected_timeouts": 0, "injected_errors": 0}
+
+    def record(self, endpoint, status, size):
+        self.stats["requests"] += 1
+        self.stats["bytes"] += size
+        self.stats["statuses"][str(status)] = self.stats["statuses"].get(str(status), 0) + 1
+        self.stats["endpoints"][endpoint] = self.stats["endpoints"].get(endpoint, 0) + 1
+
+    async def misbehave(self, endpoint):
+        # Returns an error response, hangs past any client timeout, or returns None to serve normally
+        if self.latency:
+            await asyncio.sleep(self.random.expovariate(1 / self.latency))
+        roll = self.random.random()
+        if roll < self.timeout_rate:
+            self.stats["injected_timeouts"] += 1
+            await asyncio.sleep(self.hang)
+        elif roll < self.timeout_rate + self.error_rate:
+            self.stats["injected_errors"] += 1
+            status = self.random.choice([429, 500, 502, 503, 504])
+            self.record(endpoint, status, 0)
+            return web.Response(status=status, headers={"Retry-After": "1"} if status == 429 else {})
+        return None
+
+    def respond(self, endpoint, payload):
+        body = json.dumps(payload).encode()
+        self.record(endpoint, 200, len(body))
+        return web.Response(body=body, content_type="application/json")
+
+    async def handle_stations(self, request):
+        return await self.misbehave("stations") or self.respond("stations", self.stations)
+
+    async def handle_measurements(self, request):
+        failure = await self.misbehave("measurements")
+        if failure is not None:
+            return failure
+        query = request.query
+        station_ids = [s for s in query.get("station_ids", "").split(",") if s] or [s["station_id"] for s in self.stations]
+        var_ids = [v for v in query.get("var_ids", "").split(",") if v]
+        limit = int(query.get("limit", "10000"))
+
+        now = datetime.now(timezone.utc)
+        newest = now - timedelta(minutes=now.minute % 5, seconds=now.second, microseconds=now.microsecond)
+        if "start_date" in query:
+            start = datetime.fromisoformat(query["start_date"].replace("Z", "+00:00"))
+        else:
+            start = newest - timedelta(days=1)
+        if "end_date" in query:
+            end = datetime.fromisoformat(query["end_date"].replace("Z", "+00:00"))
+            newest = min(newest, end - timedelta(minutes=end.minute % 5, seconds=end.second, microseconds=end.microsecond))
+
+        # Newest rows first, like the live API
+        rows = []
+        when = newest
+        while when >= start and len(rows) < limit:
+            timestamp = when.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            for station_id in station_ids:
+                carried = self.station_vars.get(station_id, set())
+                for variable in var_ids or sorted(carried):
+                    if variable in carried:
+                        rows.append({
+                            "station_id": station_id,
+                            "variable": variable,
+                            "timestamp": timestamp,
+                            "value": str(synthetic_value(station_id, variable, when)),
+                            "flag": 0
+                        })
+            when -= timedelta(minutes=5)
+        return self.respond("measurements", rows[:limit])
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats)
+
+    async def handle_reset(self, request):
+        self.reset()
+        return web.json_response(self.stats)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/mesonet/db/stations", self.handle_stations)
+        app.router.add_get("/mesonet/db/measurements", self.handle_measurements)
+        app.router.add_get("/_stats", self.handle_stats)
+        app.router.add_post("/_reset", self.handle_reset)
+        return app
+
+
+def add_arguments(parser):
+    parser.add_argument("--stations", type=int, default=80, help="number of stations to serve")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean added latency per request in seconds")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of requests that hang")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429/5xx")
+    parser.add_argument("--hang", type=float, default=60.0, help="seconds a hung request waits before answering")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic HCDP mesonet API")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    api = MockApi(args.stations, args.latency, args.timeout_rate, args.error_rate, args.hang, args.seed)
+    print(f"Serving {len(api.stations)} stations on http://localhost:{args.port}")
+    web.run_app(api.app(), port=args.port, print=None)
@@ -0,0 +1,119 @@
+import argparse
+import os
+import tempfile
+
+from archive_google_sheet import SHEET, SPREADSHEET_ID, archive_log, archived_rows, clear_archived
+
+# In-memory stand-in for the parts of the Sheets v4 service the run log archive uses
+# (spreadsheets().get, values().get and batchUpdate deleteDimension), so the archiver can be
+# exercised without credentials:
+#   python scripts/mock_sheets.py --rows 12000 --append-every 3
+
+
+class FakeRequest:
+    def __init__(self, handler):
+        self.handler = handler
+
+    def execute(self, num_retries=0):
+        return self.handler()
+
+
+class FakeSheetsService:
+    """Holds one sheet as a list of rows (row 1 first) and answers like the Sheets API.
+
+    Reads return formatted (string) values with trailing empty cells and
+    rows trimmed. `on_read` is called after every values().get, so a test
+    can append rows while an archive is being taken.
+    """
+
+    def __init__(self, rows, sheet=SHEET, sheet_id=0, row_count=None, on_read=None):
+        self.rows = [list(row) for row in rows]
+        self.sheet = sheet
+        self.sheet_id = sheet_id
+        self.row_count = row_count or max(1000, len(self.rows))
+        self.on_read = on_read
+        self.reads = 0
+        self.batch_updates = 0
+
+    # service.spreadsheets() and service.spreadsheets().values() both come back to this object
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range=None, fields=None):
+        if range is None:
+            return FakeRequest(lambda: {"sheets": [{"properties": {
+                "sheetId": self.sheet_id, "title": self.sheet, "gridProperties": {"rowCount": self.row_count}
+            }}]})
+        return FakeRequest(lambda: self.read(range))
+
+    def batchUpdate(self, spreadsheetId, body):
+        return FakeRequest(lambda: self.update(body))
+
+    def read(self, a1_range):
+        sheet, rows = a1_range.split("!")
+        first, last = (int(n) for n in rows.split(":"))
+        if sheet != self.sheet or last > self.row_count:
+            raise ValueError(f"Range {a1_range} exceeds grid limits")
+        self.reads += 1
+        values = [[str(cell) for cell in row] for row in self.rows[first - 1:last]]
+        for row in values:
+            while row and row[-1] == "":
+                row.pop()
+        while values and not values[-1]:
+            values.pop()
+        if self.on_read is not None:
+            self.on_read(self)
+        return {"range": a1_range, "values": values} if values else {"range": a1_range}
+
+    def update(self, body):
+        self.batch_updates += 1
+        for request in body["requests"]:
+            target = request["deleteDimension"]["range"]
+            assert target["sheetId"] == self.sheet_id and target["dimension"] == "ROWS"
+            del self.rows[target["startIndex"]:target["endIndex"]]
+        return {"spreadsheetId": SPREADSHEET_ID, "replies": [{} for _ in body["requests"]]}
+
+    def append(self, row):
+        self.rows.append(list(row))
+        self.row_count = max(self.row_count, len(self.rows))
+
+
+def log_row(i):
+    return [f"2025-01-01T00:{i % 60:02d}:00Z", "Run Data Map Measurements", "success", str(i), "note, with \"quotes\"" if i % 7 == 0 else ""]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive and clear a fake run log sheet and check the result")
+    parser.add_argument("--rows", type=int, default=12000, help="data rows in the fake sheet")
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    parser.add_argument("--append-every", type=int, default=0, help="append a row after every Nth read, as a concurrent run would")
+    args = parser.parse_args()
+
+    appended = []
+
+    def append_rows(service):
+        if args.append_every and service.reads % args.append_every == 0:
+            row = log_row(args.rows + len(appended))
+            appended.append(row)
+            service.append(row)
+
+    header = ["timestamp", "workflow", "status", "run", "note"]
+    service = FakeSheetsService([header] + [log_row(i) for i in range(args.rows)], on_read=append_rows)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "google_sheet.csv.gz")
+        count = archive_log(service, path, args.chunk_rows)
+        first, archived = archived_rows(path)
+        service.on_read = None
+        cleared = clear_archived(service, path)
+
+    # Every archived row is gone, every row appended after the last read is still there, under the header
+    remaining = service.rows[1:]
+    assert archived == count == cleared, (archived, count, cleared)
+    assert service.rows[0] == header and service.batch_updates == (1 if count else 0)
+    assert len(remaining) == args.rows + len(appended) - count
+    assert all(row[3] == str(count + i) for i, row in enumerate(remaining))
+    print(f"OK: archived and cleared {count} rows in {service.reads} reads, {len(remaining)} later rows kept")
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# Change-aware output: files are only rewritten when their data changed, and always atomically
+
+
+def content_hash(payload, ignore=()):
+    # Canonical form: key order and whitespace do not count as a change, nor do the top-level keys in ignore
+    if ignore:
+        payload = {key: value for key, value in payload.items() if key not in ignore}
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def atomic_write(filename, data):
+    # Temp file in the same directory + rename, so readers never see a half-written file
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(filename)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, filename)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class OutputWriter:
+    """Writes data products and remembers their content hashes between runs.
+
+    A product whose hash matches the previous run's is not written at all,
+    so it never shows up as a change on data-branch. Every file that was
+    written is listed in the manifest, one name per line, for `git add`.
+    """
+
+    def __init__(self, hashes_path="output_hashes.json", manifest_path="changed_files.txt"):
+        self.hashes_path = hashes_path
+        self.manifest_path = manifest_path
+        self.previous = {}
+        if hashes_path and os.path.exists(hashes_path):
+            with open(hashes_path) as hashes_file:
+                self.previous = json.load(hashes_file)
+        self.hashes = dict(self.previous)
+        self.changed = []
+
+    def _write(self, filename, digest, data):
+        self.hashes[filename] = digest
+        if self.previous.get(filename) == digest:
+            print(f"Unchanged {filename}")
+            return False
+        atomic_write(filename, data)
+        self.changed.append(filename)
+        print(f"Saved {filename}")
+        return True
+
+    def write_json(self, filename, payload, indent=4, ignore=()):
+        # Keys in ignore (a run timestamp, say) are written but do not make the file count as changed
+        return self._write(filename, content_hash(payload, ignore), json.dumps(payload, indent=indent).encode())
+
+    def write_bytes(self, filename, data, digest=None):
+        # digest stands in for the hash of data when the bytes carry something that should not count as a change
+        return self._write(filename, digest or hashlib.sha256(data).hexdigest(), data)
+
+    def finish(self):
+        if self.hashes_path:
+            atomic_write(self.hashes_path, json.dumps(self.hashes, indent=4, sort_keys=True).encode())
+        if self.manifest_path:
+            atomic_write(self.manifest_path, "".join(f"{filename}\n" for filename in self.changed).encode())
+        print(f"{len(self.changed)} changed file(s) listed in {self.manifest_path}")
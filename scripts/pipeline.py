@@ -0,0 +1,369 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import aggregates
+import climatology
+import datamap
+import diagnosticMeasurements as diagnostics
+import grids
+import latestMeasurements as latest_report
+import snapshot
+from batching import fetch_latest, fill_missing, stream_series, window_rows, window_start, within_window
+from capabilities import load_capabilities
+from hcdp import FetchEngine, DEFAULT_CONCURRENCY, stations_url
+from metrics import RunMetrics
+from output import OutputWriter, atomic_write
+from qc import latest_records
+from rainfall import RAINFALL_STATE_PATH, update_rainfall
+from scheduler import (
+    CircuitBreaker, with_priority,
+    PRIORITY_STATIONS, PRIORITY_MAP, PRIORITY_LATEST, PRIORITY_DIAGNOSTICS
+)
+from series_store import SERIES_STORE_PATH, SeriesStore, stream_window
+from sharding import Shard, merge_freshness, merge_products, merge_stations, shard_path
+
+# Single entry point for every data product: fetches the union of what the selected stages need once and fans it out
+
+STAGES = ["datamap", "wind", "rainfall", "anomalies", "grids", "aggregates", "diagnostics", "latest"]
+
+# Seconds the whole fetch may take before the run writes whatever is complete (override with HCDP_DEADLINE)
+DEFAULT_DEADLINE = float(os.environ["HCDP_DEADLINE"]) if os.getenv("HCDP_DEADLINE") else None
+
+# Also write {run_name}_snapshot.json(.gz/.br) holding every product in one compact file (or pass --snapshot)
+WRITE_SNAPSHOT = os.getenv("HCDP_SNAPSHOT", "") not in ("", "0", "false")
+
+# Run only this shard of the stations and write a partial file for a later --merge (see sharding.py; or pass --shard)
+DEFAULT_SHARD = os.getenv("HCDP_SHARD") or None
+
+
+async def fetch_stations(engine):
+    try:
+        stations = await with_priority(PRIORITY_STATIONS, engine.get_json(stations_url, timeout=30))
+    except asyncio.TimeoutError:
+        stations = None
+    if stations is None:
+        print("Failed to retrieve stations")
+        stations = []
+    return stations
+
+
+async def fetch_all(stages, concurrency=DEFAULT_CONCURRENCY, deadline=None, breaker=None, metrics=None, engine=None, stations=None, shard=None):
+    # A caller that keeps its own engine (the daemon) passes it in, along with a station list it already holds
+    if engine is None:
+        async with FetchEngine(concurrency) as engine:
+            return await fetch_all(stages, concurrency, deadline, breaker, metrics, engine, stations, shard)
+    engine.start_run(deadline, breaker, metrics)
+
+    now = datetime.now(timezone.utc)
+    fetched = {"now": now, "diagnostics": diagnostics.DiagnosticAccumulator(), "latest": {}, "rainfall": {}, "valid_ids": []}
+    # Workers of a sharded run keep their own local state, so they never write the same files
+    store_path = shard_path(SERIES_STORE_PATH, shard) if shard is not None and SERIES_STORE_PATH else SERIES_STORE_PATH
+    rainfall_path = shard_path(RAINFALL_STATE_PATH, shard) if shard is not None else RAINFALL_STATE_PATH
+    store = SeriesStore(store_path) if ("diagnostics" in stages or "aggregates" in stages) and store_path else None
+
+    if stations is None:
+        stations = await fetch_stations(engine)
+    capabilities = load_capabilities().refresh(stations)
+    # all_stations is the full list, which a merge lays the shards' products out by
+    fetched["all_stations"] = stations
+    if shard is not None:
+        stations = [s for s in stations if shard.includes(s["station_id"])]
+        print(f"Shard {shard.spec}: {len(stations)} of {len(fetched['all_stations'])} stations")
+    fetched["stations"] = stations
+
+    # Stations with an open circuit breaker sit this run out
+    skipped = {s["station_id"] for s in stations if breaker is not None and breaker.is_open(s["station_id"])}
+    station_ids = [s["station_id"] for s in stations if s["station_id"] not in skipped]
+    active_ids = [s["station_id"] for s in stations if s.get("status") == "active" and s["station_id"] not in skipped]
+
+    # Anomalies and grids are computed from the data map's latest values (and the 24-hour rainfall)
+    wants_map = any(stage in stages for stage in ("datamap", "wind", "anomalies", "grids"))
+    wants_latest = "latest" in stages
+
+    # The 24-hour diagnostic window also contains the newest Tair/RH rows, so those are not asked for again
+    series_vars = set(diagnostics.pair_variables) if "diagnostics" in stages else set()
+    latest_vars = []
+    if wants_map:
+        latest_vars += datamap.expected_variables
+    if wants_latest:
+        latest_vars += latest_report.variables
+    query_vars = [v for v in dict.fromkeys(latest_vars) if v not in series_vars]
+    query_ids = station_ids if wants_latest else active_ids
+
+    # Map products are served first and diagnostics last, so a deadline cuts the least important work
+    tasks = {}
+    if "diagnostics" in stages:
+        diag_vars = diagnostics.variables + diagnostics.pair_variables
+        # Rows go straight into running aggregates instead of being collected per series
+        consume = within_window(fetched["diagnostics"].add, now, 24)
+        if store is not None:
+            # Only rows newer than what the local store already holds cross the network
+            series_task = stream_window(engine, store, station_ids, diag_vars, 24, consume, now, capabilities)
+        else:
+            series_task = stream_series(
+                engine, station_ids, diag_vars, window_start(now, 24), window_rows(24), consume, capabilities=capabilities
+            )
+        tasks["diagnostic_rows"] = with_priority(PRIORITY_DIAGNOSTICS, series_task)
+    if query_vars:
+        tasks["latest"] = with_priority(
+            PRIORITY_MAP if wants_map else PRIORITY_LATEST,
+            fetch_latest(engine, query_ids, query_vars, fallback=False, capabilities=capabilities)
+        )
+    if "rainfall" in stages or "anomalies" in stages:
+        tasks["rainfall"] = with_priority(PRIORITY_MAP, update_rainfall(engine, active_ids, rainfall_path, now=now, capabilities=capabilities))
+    if "aggregates" in stages:
+        tasks["aggregates"] = with_priority(
+            PRIORITY_DIAGNOSTICS, aggregates.collect_aggregates(engine, store, active_ids, now, capabilities)
+        )
+    fetched.update(zip(tasks, await asyncio.gather(*tasks.values())))
+
+    latest = fetched["latest"]
+    # Newest Tair/RH values from the diagnostic window, checked against the rows before them
+    latest.update(latest_records({pair: rows for pair, rows in fetched["diagnostics"].recent.items() if pair[1] in series_vars}))
+
+    # Single-series fallbacks only for pairs no batched query returned
+    fallbacks = []
+    if wants_map:
+        map_pairs = [(station_id, v) for station_id in active_ids for v in datamap.expected_variables]
+        fallbacks.append(with_priority(PRIORITY_MAP, fill_missing(engine, latest, map_pairs, capabilities)))
+    if wants_latest:
+        # Only stations that returned a value for the first variable are reported on
+        first_var = latest_report.variables[0]
+        await with_priority(PRIORITY_LATEST, fill_missing(
+            engine, latest, [(station_id, first_var) for station_id in station_ids], capabilities
+        ))
+        for station_id in station_ids:
+            if (station_id, first_var) in latest:
+                fetched["valid_ids"].append(station_id)
+            else:
+                print(f"Skipping station {station_id} (no valid data or request failed)")
+        latest_pairs = [(station_id, v) for station_id in fetched["valid_ids"] for v in latest_report.variables]
+        fallbacks.append(with_priority(PRIORITY_LATEST, fill_missing(engine, latest, latest_pairs, capabilities)))
+    await asyncio.gather(*fallbacks)
+
+    if engine.expired():
+        print(f"Run deadline of {deadline}s reached; writing the data that completed")
+
+    if store is not None:
+        store.close()
+
+    fetched["freshness"] = {
+        "generated": now.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "complete": not skipped and not engine.incomplete,
+        "stations": {
+            s["station_id"]: "skipped" if s["station_id"] in skipped else "partial" if s["station_id"] in engine.incomplete else "complete"
+            for s in stations
+        }
+    }
+    return fetched
+
+
+def build_products(stages, fetched):
+    products = {}
+    stations = fetched["stations"]
+
+    if any(stage in stages for stage in ("datamap", "wind", "anomalies", "grids")):
+        active_stations = [s for s in stations if s.get("status") == "active"]
+        products["datamap"], products["wind"] = datamap.build_datamap(active_stations, fetched["latest"], fetched["now"])
+    if "rainfall" in stages or "anomalies" in stages:
+        products["rainfall"] = fetched["rainfall"]
+    if "anomalies" in stages:
+        products["anomalies"] = climatology.compute_anomalies(
+            climatology.load_bundle(), products["datamap"].get("Tair_1_Avg", {}), products["rainfall"]
+        )
+    if "grids" in stages:
+        products["grids"] = grids.build_grids(stations, products["datamap"], products["wind"], products.get("rainfall"))
+    if "aggregates" in stages:
+        active_ids = [s["station_id"] for s in stations if s.get("status") == "active"]
+        products["aggregates"] = aggregates.build_aggregates(active_ids, fetched["aggregates"])
+    if "diagnostics" in stages:
+        products["diagnostics"] = diagnostics.build_diagnostics(stations, fetched["diagnostics"])
+    if "latest" in stages:
+        products["latest"] = latest_report.build_latest(fetched["valid_ids"], fetched["latest"])
+    return products
+
+
+def save_products(stages, products, writer):
+    if "wind" in stages:
+        datamap.save_wind(products["wind"], writer)
+    if "datamap" in stages:
+        datamap.save_variables(products["datamap"], writer)
+    if "rainfall" in stages:
+        datamap.save_rainfall(products["rainfall"], writer)
+    if "anomalies" in stages:
+        climatology.save_anomalies(products["anomalies"], writer)
+    if "grids" in stages:
+        grids.save_grids(products["grids"], writer)
+    if "aggregates" in stages:
+        aggregates.save_aggregates(products["aggregates"], writer)
+    if "diagnostics" in stages:
+        diagnostics.save_diagnostics(*products["diagnostics"], writer)
+    if "latest" in stages:
+        latest_report.save_latest(*products["latest"], writer)
+
+
+def save_freshness(run_name, freshness, writer):
+    # Rewritten only when a station's status changes, so "generated" is the run that last changed it
+    writer.write_json(f"{run_name}_freshness.json", freshness, ignore=("generated",))
+
+
+def run_pipeline(stages=STAGES, concurrency=DEFAULT_CONCURRENCY, deadline=DEFAULT_DEADLINE, run_name="pipeline", write_snapshot=WRITE_SNAPSHOT, shard=DEFAULT_SHARD):
+    # Each job keeps its own breaker state so the hourly and 15-minute runs do not overwrite each other's
+    shard = Shard(shard) if isinstance(shard, str) else shard
+    state_path = os.getenv("CIRCUIT_STATE", f"{run_name}_circuit_state.json")
+    breaker = CircuitBreaker(state_path if shard is None else shard_path(state_path, shard))
+    metrics = RunMetrics()
+    fetched = asyncio.run(fetch_all(stages, concurrency, deadline, breaker, metrics, shard=shard))
+    breaker.save()
+    if shard is not None:
+        return save_partial(stages, fetched, run_name, shard, metrics)
+    return publish(stages, fetched, run_name, metrics, write_snapshot)
+
+
+def open_writer(run_name):
+    # Only products whose content changed are rewritten; the workflow commits exactly the files in {run_name}_changed.txt
+    return OutputWriter(
+        os.getenv("OUTPUT_HASHES", f"{run_name}_output_hashes.json"),
+        os.getenv("CHANGED_MANIFEST", f"{run_name}_changed.txt")
+    )
+
+
+def write_products(stages, products, stations, freshness, run_name, writer, write_snapshot=WRITE_SNAPSHOT):
+    save_products(stages, products, writer)
+    save_freshness(run_name, freshness, writer)
+    if write_snapshot:
+        snapshot.write_snapshot(
+            snapshot.build_snapshot(stations, products, freshness["generated"]), f"{run_name}_snapshot.json", writer
+        )
+
+
+def publish(stages, fetched, run_name, metrics, write_snapshot=WRITE_SNAPSHOT):
+    writer = open_writer(run_name)
+    with metrics.timer("processing"):
+        products = build_products(stages, fetched)
+    with metrics.timer("writing"):
+        write_products(stages, products, fetched["stations"], fetched["freshness"], run_name, writer, write_snapshot)
+    writer.write_json(f"{run_name}_run_summary.json", metrics.summary(run_name, fetched["freshness"]))
+    writer.finish()
+    return products
+
+
+def partial_path(run_name, shard):
+    return f"{run_name}.{shard.label}.partial.json"
+
+
+def save_partial(stages, fetched, run_name, shard, metrics):
+    # A shard's products, before grids (which need every station), for merge_partials()
+    with metrics.timer("processing"):
+        products = build_products([stage for stage in stages if stage != "grids"], fetched)
+    path = partial_path(run_name, shard)
+    partial = {
+        "run_name": run_name,
+        "shard": shard.spec,
+        "stages": stages,
+        "stations": fetched["all_stations"],
+        "products": products,
+        "freshness": fetched["freshness"],
+        "summary": metrics.summary(f"{run_name}.{shard.label}", fetched["freshness"])
+    }
+    atomic_write(path, json.dumps(partial, separators=(",", ":")).encode())
+    print(f"Saved {path}")
+    return products
+
+
+def merge_partials(paths, run_name, write_snapshot=WRITE_SNAPSHOT, since=None):
+    """Writes the products of a sharded run from its workers' partial files.
+
+    The partials are taken in shard order, whatever order the paths come
+    in, so the same partials always give byte-identical files. Partials
+    generated before `since` (an ISO timestamp) are left out, so their
+    stations are marked missing rather than published stale.
+    """
+    partials = []
+    for path in paths:
+        with open(path) as partial_file:
+            partial = json.load(partial_file)
+        if since is not None and partial["freshness"]["generated"] < since:
+            print(f"Skipping {path}: generated {partial['freshness']['generated']}, before this run started at {since}")
+            continue
+        partials.append(partial)
+    if not partials:
+        raise RuntimeError("no current partial file to merge")
+    partials.sort(key=lambda partial: partial["shard"])
+    stages = partials[0]["stages"]
+    if any(partial["stages"] != stages for partial in partials):
+        raise ValueError("partials were written for different stages")
+
+    stations = merge_stations(partials)
+    products = merge_products(partials, [s["station_id"] for s in stations])
+    if "grids" in stages:
+        products["grids"] = grids.build_grids(stations, products["datamap"], products["wind"], products.get("rainfall"))
+    freshness = merge_freshness(partials, stations)
+
+    writer = open_writer(run_name)
+    write_products(stages, products, stations, freshness, run_name, writer, write_snapshot)
+    writer.write_json(f"{run_name}_run_summary.json", {
+        "run": run_name, "freshness": freshness, "shards": {partial["shard"]: partial["summary"] for partial in partials}
+    })
+    writer.finish()
+    return products
+
+
+def run_sharded(count, stages, concurrency, deadline, run_name, write_snapshot=WRITE_SNAPSHOT):
+    # Runs hash:1/count .. hash:count/count as parallel worker processes, then merges what they wrote
+    shards = [Shard(f"hash:{i}/{count}") for i in range(1, count + 1)]
+    started = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    workers = []
+    for shard in shards:
+        # A partial left by an earlier run must never stand in for a worker that fails this time
+        if os.path.exists(partial_path(run_name, shard)):
+            os.remove(partial_path(run_name, shard))
+        command = [sys.executable, os.path.abspath(__file__), "--stages", ",".join(stages), "--run-name", run_name,
+                   "--concurrency", str(concurrency), "--shard", shard.spec]
+        if deadline is not None:
+            command += ["--deadline", str(deadline)]
+        workers.append(subprocess.Popen(command))
+    exits = [worker.wait() for worker in workers]
+    failed = [shard.spec for shard, code in zip(shards, exits) if code != 0]
+    if failed:
+        print(f"Shard(s) {', '.join(failed)} failed; their stations are marked missing")
+    paths = [partial_path(run_name, shard) for shard, code in zip(shards, exits) if code == 0 and os.path.exists(partial_path(run_name, shard))]
+    if not paths:
+        raise RuntimeError("no shard wrote a partial file")
+    return merge_partials(paths, run_name, write_snapshot, since=started)
+
+
+def parse_stages(value):
+    stages = [stage.strip() for stage in value.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown stage(s): {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch mesonet data once and write the selected products")
+    parser.add_argument("--stages", type=parse_stages, default=STAGES, help=f"comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="maximum requests in flight")
+    parser.add_argument("--deadline", type=float, default=DEFAULT_DEADLINE, help="seconds before the run stops fetching and writes what it has")
+    parser.add_argument("--run-name", default="pipeline", help="prefix for this job's freshness and circuit-breaker files")
+    parser.add_argument("--snapshot", action="store_true", default=WRITE_SNAPSHOT, help="also write one compact columnar snapshot of every product")
+    parser.add_argument("--shard", default=DEFAULT_SHARD, help="only run this shard (hash:I/N, range:LOW-HIGH or island:NAME) and write a partial file")
+    parser.add_argument("--merge", nargs="+", metavar="PARTIAL", help="write the products from the partial files of a sharded run instead of fetching")
+    parser.add_argument("--shards", type=int, help="run this many hash shards as parallel processes, then merge them")
+    args = parser.parse_args()
+    if args.merge:
+        merge_partials(args.merge, args.run_name, args.snapshot)
+    elif args.shards:
+        run_sharded(args.shards, args.stages, args.concurrency, args.deadline, args.run_name, args.snapshot)
+    else:
+        try:
+            shard = Shard(args.shard) if args.shard else None
+        except ValueError as e:
+            parser.error(str(e))
+        run_pipeline(args.stages, args.concurrency, args.deadline, args.run_name, args.snapshot, shard)
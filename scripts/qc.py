@@ -0,0 +1,259 @@
+import math
+
+import numpy as np
+
+from records import Measurement, epoch_seconds, float_values
+
+# Quality control of measurement values: physical range limits, rate-of-change and flatline tests,
+# run over a whole batch of rows as array operations. Each value gets a bitmask of the failed tests.
+
+QC_OK = 0
+QC_RANGE = 1  # outside what the sensor can physically report; the value is not published
+QC_SPIKE = 2  # changed more than the variable plausibly can since the previous sample
+QC_FLATLINE = 4  # identical to the samples before it for longer than the variable plausibly stays constant
+
+# Variable -> (lowest, highest) plausible value
+RANGE_LIMITS = {
+    "Tair_1_Avg": (-10, 45), "Tair_2_Avg": (-10, 45),
+    "RH_1_Avg": (0, 103), "RH_2_Avg": (0, 103),
+    "SWin_1_Avg": (-5, 1600),
+    "SM_1_Avg": (0, 0.6),
+    "Tsoil_1_Avg": (-5, 60),
+    "WS_1_Avg": (0, 75),
+    "WDrs_1_Avg": (0, 360),
+    "P_1": (60, 110),  # kPa; the summit stations sit near 62
+    "RF_1_Tot300s": (0, 50), "RF_1_Tot900s": (0, 100)
+}
+
+# Variable -> largest plausible change between consecutive samples; cloud edges make solar radiation,
+# and gusts make wind, too jumpy for a step test
+SPIKE_LIMITS = {
+    "Tair_1_Avg": 4, "Tair_2_Avg": 4,
+    "RH_1_Avg": 25, "RH_2_Avg": 25,
+    "SM_1_Avg": 0.1,
+    "Tsoil_1_Avg": 3,
+    "P_1": 0.5
+}
+
+# Variable -> identical consecutive samples that count as a stuck sensor (12 = one hour of 5-minute data).
+# Rainfall, radiation at night and calm wind sit at zero for hours, so they are not tested.
+FLATLINE_SAMPLES = {
+    "Tair_1_Avg": 12, "Tair_2_Avg": 12,
+    "RH_1_Avg": 12, "RH_2_Avg": 12,
+    "P_1": 12
+}
+SATURATED_RH = 99  # relative humidity holds at 100% for hours in fog, so only lower plateaus count
+
+# Samples further apart than this are not compared by the spike and flatline tests
+MAX_GAP_SECONDS = 15 * 60
+
+
+# Rows a SeriesBatch collects before parsing them into arrays
+PARSE_ROWS = 50000
+
+
+def limit_column(variables, limits, default):
+    # Per-row limit for an array of variable ids, looked up once per distinct variable
+    names, codes = np.unique(variables, return_inverse=True)
+    return np.array([limits.get(name, default) for name in names], dtype=float)[codes.ravel()]
+
+
+def out_of_range(variables, values):
+    # Range test of a whole array of values; NaN never fails it
+    variables = np.asarray(variables, dtype=str)
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return np.zeros(0, dtype=bool)
+    lows = limit_column(variables, {name: limits[0] for name, limits in RANGE_LIMITS.items()}, -np.inf)
+    highs = limit_column(variables, {name: limits[1] for name, limits in RANGE_LIMITS.items()}, np.inf)
+    return (values < lows) | (values > highs)
+
+
+def qc_flags(series, variables, times, values):
+    """QC bitmask of every row of a batch, in the order given.
+
+    series holds any per-row series key (e.g. an integer per station and
+    variable) that groups the rows; times are epoch seconds, distinct within
+    a series, and values floats with NaN for missing. The rows of a series
+    may come in any order. A NaN value is never flagged and never takes
+    part in the spike or flatline tests.
+    """
+    variables = np.asarray(variables, dtype=str)
+    times = np.asarray(times, dtype="int64")
+    values = np.asarray(values, dtype=float)
+    flags = np.zeros(len(values), dtype="uint8")
+    if len(values) == 0:
+        return flags
+    failed_range = out_of_range(variables, values)
+    flags[failed_range] |= QC_RANGE
+
+    # Oldest first within each series, so each row can be compared with the one before it
+    _, codes = np.unique(np.asarray(series), return_inverse=True)
+    order = np.lexsort((times, codes.ravel()))
+    codes, names, t, v = codes.ravel()[order], variables[order], times[order], values[order]
+    usable = ~np.isnan(v) & ~failed_range[order]
+    follows = (codes[1:] == codes[:-1]) & (t[1:] - t[:-1] <= MAX_GAP_SECONDS) & usable[1:] & usable[:-1]
+    change = np.abs(v[1:] - v[:-1])
+
+    spike_limits = limit_column(names, SPIKE_LIMITS, np.inf)
+    jump = np.concatenate([[False], follows & (change > spike_limits[1:])])
+    # Coming back to the level before a spike is not a spike itself
+    back = np.zeros(len(v), dtype=bool)
+    back[2:] = jump[1:-1] & follows[:-1] & (np.abs(v[2:] - v[:-2]) <= spike_limits[2:])
+    sorted_flags = np.zeros(len(v), dtype="uint8")
+    sorted_flags[jump & ~back] |= QC_SPIKE
+
+    # Length of the run of identical values each row ends: a row that starts a run resets the count
+    index = np.arange(len(v))
+    same = np.concatenate([[False], follows & (change == 0)])
+    run_length = index - np.maximum.accumulate(np.where(same, 0, index)) + 1
+    saturated = np.char.startswith(names, "RH_") & (v >= SATURATED_RH)
+    sorted_flags[(run_length >= limit_column(names, FLATLINE_SAMPLES, np.inf)) & ~saturated] |= QC_FLATLINE
+
+    flags[order] |= sorted_flags
+    return flags
+
+
+def latest_records(series):
+    """{key: newest Measurement of the series, with its qc flags} from {key: [row dicts]}.
+
+    Every row of every series is checked in one pass, so the newest value
+    is tested against the samples before it; a series of one row only gets
+    the range test.
+    """
+    keys = [key for key, rows in series.items() if rows]
+    rows = [entry for key in keys for entry in series[key]]
+    if not rows:
+        return {}
+    lengths = [len(series[key]) for key in keys]
+    ids = np.repeat(np.arange(len(keys)), lengths)
+    variables = [entry["variable"] for entry in rows]
+    times = epoch_seconds([entry["timestamp"] for entry in rows])
+    values = float_values([entry.get("value") for entry in rows])
+    flags = qc_flags(ids, variables, times, values)
+
+    # Index of each series' newest row: the last of its block once the blocks are sorted by time
+    order = np.lexsort((times, ids))
+    newest = order[np.cumsum(lengths) - 1]
+    latest = {}
+    for key, i in zip(keys, newest.tolist()):
+        entry = rows[i]
+        value = values[i]
+        latest[key] = Measurement(
+            entry["station_id"], entry["variable"], int(times[i]), entry["timestamp"], None if value != value else float(value), int(flags[i])
+        )
+    return latest
+
+
+def checked_records(rows):
+    # API row dicts -> Measurements with their qc flags, parsing and checking the whole batch in one pass
+    rows = list(rows)
+    if not rows:
+        return []
+    times = epoch_seconds([entry["timestamp"] for entry in rows])
+    values = float_values([entry.get("value") for entry in rows])
+    series = [f"{entry['station_id']}|{entry['variable']}" for entry in rows]
+    flags = qc_flags(series, [entry["variable"] for entry in rows], times, values)
+    return [
+        Measurement(entry["station_id"], entry["variable"], time, entry["timestamp"], None if value != value else value, flag)
+        for entry, time, value, flag in zip(rows, times.tolist(), values.tolist(), flags.tolist())
+    ]
+
+
+class SeriesQc:
+    """OR of the qc_flags() of one series, folded one row at a time, newest first.
+
+    Only the previous row and the length of the current run of identical
+    values are kept, so a whole window is checked in constant memory. For
+    the OR any jump is a spike: the oldest jump of a series cannot be a
+    return from one before it, so qc_flags() always flags it.
+    """
+
+    def __init__(self, variable):
+        self.low, self.high = RANGE_LIMITS.get(variable, (-math.inf, math.inf))
+        self.spike_limit = SPIKE_LIMITS.get(variable, math.inf)
+        self.flatline_samples = FLATLINE_SAMPLES.get(variable, math.inf)
+        self.saturates = variable.startswith("RH_")
+        self.previous = None  # (time, value) of the last row taken; value is None when it was not usable
+        self.run = 0
+        self.qc = QC_OK
+
+    def add(self, time, value):
+        # value is a float or None; returns the value if it is usable (a finite number within range), else None
+        if value is not None and not math.isfinite(value):
+            value = None
+        if value is not None and not self.low <= value <= self.high:
+            self.qc |= QC_RANGE
+            value = None
+
+        previous = self.previous
+        follows = previous is not None and value is not None and previous[1] is not None and previous[0] - time <= MAX_GAP_SECONDS
+        if follows and abs(previous[1] - value) > self.spike_limit:
+            self.qc |= QC_SPIKE
+        self.run = self.run + 1 if follows and value == previous[1] else 1
+        if self.run >= self.flatline_samples and not (self.saturates and value >= SATURATED_RH):
+            self.qc |= QC_FLATLINE
+        self.previous = (time, value)
+        return value
+
+    def flags(self):
+        return self.qc
+
+
+class SeriesBatch:
+    """Rows of many series, gathered one at a time and parsed into arrays PARSE_ROWS at a time.
+
+    For stages that stream rows in and want the quality control of the
+    whole window in one qc_flags pass at the end, without holding every
+    row dict meanwhile. `newest` keeps the API timestamp string of each
+    series' newest value that is a number within range, found while a
+    parsed chunk still has its strings.
+    """
+
+    def __init__(self):
+        self.codes = {}  # series key -> code
+        self.keys = []  # code -> series key
+        self.variables = []  # code -> variable id
+        self.pending = ([], [], [])  # codes, timestamps, values not parsed yet
+        self.parsed = []  # (codes, times, values) arrays
+        self.newest = {}  # code -> (time, timestamp)
+
+    def add(self, key, variable, timestamp, value):
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.keys)
+            self.keys.append(key)
+            self.variables.append(variable)
+        self.pending[0].append(code)
+        self.pending[1].append(timestamp)
+        self.pending[2].append(value)
+        if len(self.pending[0]) >= PARSE_ROWS:
+            self.parse()
+
+    def parse(self):
+        codes, timestamps, values = self.pending
+        if not codes:
+            return
+        codes = np.array(codes, dtype="int64")
+        times = epoch_seconds(timestamps)
+        values = float_values(values)
+        usable = np.flatnonzero(~np.isnan(values) & ~out_of_range(np.array(self.variables)[codes], values))
+        # Newest usable row per series in this chunk: sort by (series, time), take each series' last row
+        last = usable[np.lexsort((times[usable], codes[usable]))]
+        ends = np.flatnonzero(np.diff(codes[last], append=-1) != 0)
+        for i in last[ends].tolist():
+            code = int(codes[i])
+            if code not in self.newest or times[i] > self.newest[code][0]:
+                self.newest[code] = (int(times[i]), timestamps[i])
+        self.parsed.append((codes, times, values))
+        self.pending = ([], [], [])
+
+    def arrays(self):
+        # (codes, variables, times, values, qc flags) of every row added
+        self.parse()
+        if not self.parsed:
+            empty = np.zeros(0, dtype="int64")
+            return empty, np.zeros(0, dtype=str), empty, np.zeros(0, dtype=float), np.zeros(0, dtype="uint8")
+        codes, times, values = (np.concatenate(parts) for parts in zip(*self.parsed))
+        variables = np.array(self.variables)[codes]
+        return codes, variables, times, values, qc_flags(codes, variables, times, values)
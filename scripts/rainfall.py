@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from batching import fetch_series, rows_since
+from qc import QC_RANGE, checked_records
+from records import epoch_seconds
+
+# Incremental 24-hour rainfall totals built from persisted 5-minute RF_1_Tot300s samples
+
+RAINFALL_VAR = "RF_1_Tot300s"
+RAINFALL_STATE_PATH = os.getenv("RAINFALL_STATE", "rainfall_state.json")
+WINDOW = timedelta(hours=24)
+
+
+def parse_timestamp(timestamp_str):
+    return datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
+
+
+class RainfallAccumulator:
+    """Ring buffer of (epoch time, timestamp, value, qc) samples for one station with a running total.
+
+    `watermark` is the timestamp string of the newest sample ever seen, so the
+    next run only has to ask the API for rows after it. The total is rebuilt
+    from the samples on load, so float drift never carries across runs.
+    Times are epoch seconds, parsed once on load or when the rows arrive.
+    Samples that failed the range test (see qc.py) stay in the window with
+    their flags but are not counted, so the total's qc shows them for as
+    long as they fall in it.
+    """
+
+    def __init__(self, samples=(), watermark=None):
+        # State saved before qc flags were kept holds [timestamp, value] pairs
+        samples = [(sample[0], sample[1], sample[2] if len(sample) > 2 else 0) for sample in samples]
+        self.samples = deque()
+        self.total = 0.0
+        self.counted = 0
+        self.watermark = watermark
+        self.watermark_time = None if watermark is None else int(epoch_seconds([watermark])[0])
+        times = epoch_seconds([timestamp_str for timestamp_str, _, _ in samples]).tolist() if samples else []
+        for time, (timestamp_str, value, qc) in zip(times, samples):
+            self.append(time, timestamp_str, value, qc)
+
+    def append(self, time, timestamp_str, value, qc):
+        self.samples.append((time, timestamp_str, value, qc))
+        if not qc & QC_RANGE:
+            self.total += value
+            self.counted += 1
+
+    def add(self, time, timestamp_str, value, qc=0):
+        if self.watermark_time is not None and time <= self.watermark_time:
+            return
+        self.append(time, timestamp_str, value, qc)
+        self.watermark = timestamp_str
+        self.watermark_time = time
+
+    def evict(self, cutoff):
+        # cutoff is epoch seconds; samples are kept oldest-first, so everything outside the window sits at the left end
+        while self.samples and self.samples[0][0] <= cutoff:
+            _, _, value, qc = self.samples.popleft()
+            if not qc & QC_RANGE:
+                self.total -= value
+                self.counted -= 1
+        if not self.counted:
+            self.total = 0.0
+
+    def to_output(self):
+        if not self.samples:
+            return {"value": None, "timestamp": None, "qc": None}
+        qc = 0
+        for sample in self.samples:
+            qc |= sample[3]
+        if not self.counted:
+            return {"value": None, "timestamp": None, "qc": qc}
+        newest = next(sample for sample in reversed(self.samples) if not sample[3] & QC_RANGE)
+        return {"value": self.total, "timestamp": newest[1], "qc": qc}
+
+    def to_state(self):
+        return {
+            "watermark": self.watermark,
+            "samples": [[timestamp_str, value, qc] for _, timestamp_str, value, qc in self.samples]
+        }
+
+
+def load_state(path=RAINFALL_STATE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as state_file:
+        state = json.load(state_file)
+    return {
+        station_id: RainfallAccumulator(entry["samples"], entry["watermark"])
+        for station_id, entry in state.items()
+    }
+
+
+def save_state(accumulators, path=RAINFALL_STATE_PATH):
+    with open(path, "w") as state_file:
+        json.dump({station_id: acc.to_state() for station_id, acc in accumulators.items()}, state_file)
+
+
+async def update_rainfall(engine, station_ids, path=RAINFALL_STATE_PATH, now=None, capabilities=None):
+    # Tops up every station's buffer with rows newer than its watermark and returns the RF_1_Tot300s_24H.json payload
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - WINDOW
+    saved = load_state(path)
+    accumulators = {station_id: saved.get(station_id) or RainfallAccumulator() for station_id in station_ids}
+
+    # Stations that report 15-minute totals (RF_1_Tot900s) are summed the same way under the same output key
+    rain_vars = {}
+    for station_id in station_ids:
+        rain_var = capabilities.resolve(station_id, RAINFALL_VAR) if capabilities else RAINFALL_VAR
+        if rain_var is not None:
+            rain_vars[station_id] = rain_var
+
+    # Stations with a recent watermark share one small delta query; new or long-silent stations need the full window
+    queries = []
+    for rain_var in dict.fromkeys(rain_vars.values()):
+        ids = [s for s, v in rain_vars.items() if v == rain_var]
+        known = [s for s in ids if accumulators[s].watermark and accumulators[s].watermark_time > cutoff.timestamp()]
+        fresh = [s for s in ids if s not in known]
+        if known:
+            oldest = datetime.fromtimestamp(min(accumulators[s].watermark_time for s in known), timezone.utc)
+            queries.append(fetch_series(
+                engine, known, [rain_var], oldest.strftime("%Y-%m-%dT%H:%M:%SZ"), rows_since(oldest, now)
+            ))
+        if fresh:
+            queries.append(fetch_series(
+                engine, fresh, [rain_var], cutoff.strftime("%Y-%m-%dT%H:%M:%SZ"), rows_since(cutoff, now)
+            ))
+
+    # Every row of the run is parsed and quality-controlled in one vectorized pass
+    results = await asyncio.gather(*queries)
+    records = {}
+    for record in checked_records(entry for result in results for rows in result.values() for entry in rows):
+        records.setdefault((record.station_id, record.variable), []).append(record)
+
+    rainfall_24H = {}
+    for station_id in station_ids:
+        acc = accumulators[station_id]
+        for record in sorted(records.get((station_id, rain_vars.get(station_id)), []), key=lambda record: record.time):
+            # Non-numeric values are skipped; readings outside the gauge's range are kept flagged but not counted
+            if record.value is not None:
+                acc.add(record.time, record.timestamp, record.value, record.qc)
+        acc.evict(cutoff.timestamp())
+        rainfall_24H[station_id] = acc.to_output()
+
+    # Stations left out of this run (e.g. behind an open circuit breaker) keep their buffers for the next one
+    save_state({**saved, **accumulators}, path)
+    return rainfall_24H
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import random
+import time
+
+# Client-side politeness toward the HCDP API: an adaptive token bucket plus jittered exponential backoff
+
+DEFAULT_RATE = float(os.getenv("HCDP_RATE", "5"))  # requests per second to start from
+MIN_RATE = 0.5
+MAX_RATE = 50.0
+SLOW_LATENCY = 2.0  # seconds; slower responses count as the server struggling
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate follows the API's behaviour.
+
+    Fast successful responses raise the rate additively; slow responses,
+    timeouts, 429 and 5xx responses cut it multiplicatively (AIMD), and a
+    Retry-After hint pauses the bucket entirely until it has passed.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE, increase=0.5, decrease=0.5, slow_latency=SLOW_LATENCY):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_latency = slow_latency
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        # Burst capacity is one second's worth of requests
+        self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self, latency):
+        if latency > self.slow_latency:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+        else:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_pushback(self, retry_after=None):
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    # "Full jitter": a random wait up to the exponential ceiling keeps retries from arriving in lockstep
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+# Shared measurement model: API rows become slotted records with the timestamp parsed once to
+# epoch seconds and the value to a float; JSON-shaped dicts only reappear in the output files
+
+EPOCH = pd.Timestamp(0, tz="UTC")
+
+
+class Measurement:
+    """One measurement row.
+
+    `time` is the timestamp in epoch seconds, for comparisons and windows;
+    `timestamp` is the API's original string, which is what the output files
+    carry. `value` is a float, or None when the API's value is not a finite number.
+    `qc` is the bitmask of failed quality-control tests (see qc.py), 0 if none.
+    """
+
+    __slots__ = ("station_id", "variable", "time", "timestamp", "value", "qc")
+
+    def __init__(self, station_id, variable, time, timestamp, value, qc=0):
+        self.station_id = station_id
+        self.variable = variable
+        self.time = time
+        self.timestamp = timestamp
+        self.value = value
+        self.qc = qc
+
+    def __repr__(self):
+        return f"Measurement({self.station_id!r}, {self.variable!r}, {self.timestamp!r}, {self.value!r})"
+
+
+def epoch_seconds(timestamps):
+    # Vectorized ISO 8601 -> int64 epoch seconds for a whole batch of timestamp strings
+    times = pd.to_datetime(pd.Series(timestamps, dtype=object), utc=True, format="ISO8601")
+    return ((times - EPOCH) // pd.Timedelta(seconds=1)).to_numpy(dtype="int64")
+
+
+def float_values(values):
+    # Vectorized value parsing; anything non-numeric, and infinities, become NaN
+    values = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=float)
+    return np.where(np.isfinite(values), values, np.nan)
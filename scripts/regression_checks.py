@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+# Every check talks to an in-process mock API, so hcdp.py must see its URL before it is imported
+PORT = int(os.getenv("CHECK_PORT", "8796"))
+os.environ["HCDP_API_URL"] = f"http://localhost:{PORT}"
+
+import numpy as np  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+from batching import fetch_series, window_rows, window_start  # noqa: E402
+from capabilities import load_capabilities  # noqa: E402
+from diagnosticMeasurements import PairStats  # noqa: E402
+from hcdp import FetchEngine  # noqa: E402
+from mock_hcdp import MockApi  # noqa: E402
+from qc import SeriesQc, qc_flags  # noqa: E402
+from scheduler import COOL_DOWN, FAILURE_THRESHOLD, CircuitBreaker  # noqa: E402
+from series_store import SeriesStore, top_up  # noqa: E402
+
+# Regression checks for behaviour that only shows across runs or under failures, run against mock_hcdp.py:
+#   python scripts/regression_checks.py [--checks store_gap,...]
+
+
+async def check_store_gap(api, directory):
+    # A fetch cut off part way leaves the newest rows stored after a hole; the next run must fill the hole
+    store = SeriesStore(os.path.join(directory, "series_store.sqlite"))
+    async with FetchEngine(4, cache=False) as engine:
+        await top_up(engine, store, ["0119"], ["Tair_1_Avg"], 24)
+        now = datetime.now(timezone.utc)
+        full = store.db.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+        store.db.execute(
+            "DELETE FROM measurements WHERE ts >= ? AND ts < ?",
+            (int((now - timedelta(hours=4)).timestamp()), int((now - timedelta(hours=1)).timestamp()))
+        )
+        store.db.execute("UPDATE coverage SET until = ?", (int((now - timedelta(hours=4)).timestamp()),))
+        store.db.commit()
+        await top_up(engine, store, ["0119"], ["Tair_1_Avg"], 24)
+    times = [ts for (ts,) in store.db.execute("SELECT ts FROM measurements ORDER BY ts")]
+    store.close()
+    gaps = [(a, b) for a, b in zip(times, times[1:]) if b - a != 300]
+    assert not gaps, f"store still has gaps {gaps}"
+    assert len(times) >= full, (len(times), full)
+
+
+async def check_empty_capabilities(api, directory):
+    # A station listed with no variables (a row like "520,") is unknown, not a station that carries nothing
+    path = os.path.join(directory, "station_variables.csv")
+    with open(path, "w") as csv_file:
+        csv_file.write("station,variables\n520,\n521,RF_1_Tot900s;Tair_1_Avg\n522,RH_1_Avg\n")
+    index = load_capabilities(path)
+    assert index.resolve("520", "RF_1_Tot300s") == "RF_1_Tot300s", index.resolve("520", "RF_1_Tot300s")
+    assert index.resolve("0520", "Tair_1_Avg") == "Tair_1_Avg"
+    assert index.resolve("521", "RF_1_Tot300s") == "RF_1_Tot900s"
+    assert index.resolve("521", "RH_1_Avg") is None
+
+
+async def check_batch_breaker(api, directory):
+    # A batched query that keeps failing opens every member station's breaker, one failure per run however often it is split
+    station_ids = [s["station_id"] for s in api.stations[:4]]
+    breaker = CircuitBreaker(os.path.join(directory, "circuit_state.json"))
+
+    async def run():
+        async with FetchEngine(4, max_retries=0, breaker=breaker, cache=False) as engine:
+            now = datetime.now(timezone.utc)
+            return await fetch_series(engine, station_ids, ["Tair_1_Avg"], window_start(now, 1), window_rows(1))
+
+    api.error_rate = 1.0
+    try:
+        for count in range(1, FAILURE_THRESHOLD + 1):
+            assert not await run()
+            assert all(breaker.state[s]["failures"] == count for s in station_ids), breaker.state
+    finally:
+        api.error_rate = 0.0
+    assert all(breaker.is_open(s) for s in station_ids), breaker.state
+
+    # After the cool-down a batch that comes back clears them all
+    breaker.now += COOL_DOWN
+    assert await run()
+    assert not breaker.state, breaker.state
+
+
+def random_series(rng, count):
+    # (time, value or None) rows oldest first, with gaps, missing and out-of-range values, spikes, steps and stuck stretches
+    rows, time, value = [], 0, 20.0
+    while len(rows) < count:
+        time += 300 if rng.random() > 0.05 else 1200
+        roll = rng.random()
+        if roll < 0.04:
+            rows.append((time, None))
+        elif roll < 0.06:
+            rows.append((time, rng.choice([-50.0, 150.0])))
+        elif roll < 0.1:
+            # One sample off, then back to the level before
+            rows.append((time, value + rng.choice([-1, 1]) * rng.uniform(5, 40)))
+        elif roll < 0.13:
+            value = round(min(max(value + rng.choice([-1, 1]) * rng.uniform(5, 40), 0), 100), 1)
+            rows.append((time, value))
+        elif roll < 0.16:
+            # Stuck, now and then at saturation
+            stuck = rng.choice([value, value, 100.0])
+            for _ in range(rng.randint(5, 16)):
+                rows.append((time, stuck))
+                time += 300
+        else:
+            value = round(min(max(value + rng.uniform(-1, 1), 0), 100), 1)
+            rows.append((time, value))
+    return rows[:count]
+
+
+async def check_series_qc(api, directory):
+    # The folded flags match the flags of the whole-window pass
+    rng = random.Random(0)
+    for variable in ["Tair_1_Avg", "RH_1_Avg", "SWin_1_Avg"] * 300:
+        rows = random_series(rng, rng.randint(1, 40))
+        series_qc = SeriesQc(variable)
+        for time, value in reversed(rows):
+            series_qc.add(time, value)
+        values = [float("nan") if value is None else value for _, value in rows]
+        expected = int(np.bitwise_or.reduce(qc_flags([0] * len(rows), [variable] * len(rows), [time for time, _ in rows], values)))
+        assert series_qc.flags() == expected, (variable, rows, series_qc.flags(), expected)
+
+
+async def check_pair_stats(api, directory):
+    # The running pair difference does not depend on how the two sensors' rows interleave
+    rng = random.Random(1)
+    for _ in range(30):
+        sensors = [random_series(rng, 300), random_series(rng, 300)]
+        rows = [(sensor, time, value) for sensor, series in enumerate(sensors) for time, value in reversed(series)]
+        usable = [{time: value for time, value in series if value is not None and -10 <= value <= 45} for series in sensors]
+        diffs = [abs(value - usable[1][time]) for time, value in usable[0].items() if time in usable[1]]
+        for order in (rows, sorted(rows, key=lambda row: -row[1])):
+            pair = PairStats("Tair")
+            for sensor, time, value in order:
+                pair.add(sensor, time, value)
+            assert pair.count == len(diffs) and abs(pair.mean() - sum(diffs) / len(diffs)) < 1e-9, (pair.count, len(diffs))
+
+
+CHECKS = {
+    "store_gap": check_store_gap,
+    "empty_capabilities": check_empty_capabilities,
+    "batch_breaker": check_batch_breaker,
+    "series_qc": check_series_qc,
+    "pair_stats": check_pair_stats
+}
+
+
+async def run_checks(names):
+    api = MockApi(station_count=20, latency=0)
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, "localhost", PORT).start()
+    try:
+        for name in names:
+            with tempfile.TemporaryDirectory() as directory:
+                await CHECKS[name](api, directory)
+            print(f"OK: {name}")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the regression checks against an in-process mock API")
+    parser.add_argument("--checks", default=",".join(CHECKS), help=f"comma-separated subset of {','.join(CHECKS)}")
+    args = parser.parse_args()
+    asyncio.run(run_checks([name.strip() for name in args.checks.split(",") if name.strip()]))
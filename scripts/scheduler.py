@@ -0,0 +1,117 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+# Run-deadline support: prioritised request slots and persisted per-station circuit breakers
+
+CIRCUIT_STATE_PATH = os.getenv("CIRCUIT_STATE", "circuit_state.json")
+FAILURE_THRESHOLD = 3
+COOL_DOWN = timedelta(hours=1)
+
+# Lower numbers are served first; tasks inherit the priority of the task that created them
+PRIORITY = contextvars.ContextVar("priority", default=0)
+PRIORITY_STATIONS = -1
+PRIORITY_MAP = 0
+PRIORITY_LATEST = 1
+PRIORITY_DIAGNOSTICS = 2
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    pass
+
+
+async def with_priority(priority, coro):
+    # Runs coro (and every request it spawns) at the given priority
+    token = PRIORITY.set(priority)
+    try:
+        return await coro
+    finally:
+        PRIORITY.reset(token)
+
+
+class PrioritySemaphore:
+    """Semaphore that hands free slots to the lowest-priority-number waiter first."""
+
+    def __init__(self, value):
+        self.value = value
+        self.waiters = []
+        self.counter = itertools.count()
+
+    async def acquire(self, priority):
+        if self.value > 0 and not self.waiters:
+            self.value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # A slot handed over just before cancellation must not leak
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.value += 1
+
+    def slot(self, priority):
+        return _Slot(self, priority)
+
+
+class _Slot:
+    def __init__(self, semaphore, priority):
+        self.semaphore = semaphore
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.semaphore.acquire(self.priority)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+
+
+class CircuitBreaker:
+    """Per-station failure counts persisted between runs.
+
+    A station whose requests fail in FAILURE_THRESHOLD runs in a row is
+    skipped until its cool-down has passed. After that it gets
+    one trial run: a success closes the breaker, another failure re-opens it.
+    """
+
+    def __init__(self, path=CIRCUIT_STATE_PATH, now=None):
+        self.path = path
+        self.now = now or datetime.now(timezone.utc)
+        self.state = {}
+        if path and os.path.exists(path):
+            with open(path) as state_file:
+                self.state = json.load(state_file)
+
+    def is_open(self, station_id):
+        entry = self.state.get(station_id)
+        if not entry or not entry.get("open_until"):
+            return False
+        return datetime.fromisoformat(entry["open_until"]) > self.now
+
+    def record_success(self, station_id):
+        self.state.pop(station_id, None)
+
+    def record_failure(self, station_id):
+        entry = self.state.setdefault(station_id, {"failures": 0, "open_until": None})
+        entry["failures"] += 1
+        if entry["failures"] >= FAILURE_THRESHOLD:
+            entry["open_until"] = (self.now + COOL_DOWN).isoformat()
+            print(f"Station {station_id}: {entry['failures']} consecutive failures, skipping until {entry['open_until']}")
+
+    def save(self):
+        if self.path:
+            with open(self.path, "w") as state_file:
+                json.dump(self.state, state_file, indent=4)
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from batching import rows_since, stream_series, window_rows, window_start
+from rainfall import parse_timestamp
+
+# Local time-series store: every fetched (station, variable, timestamp) row is kept on disk,
+# so each run only asks the API for rows newer than what it already has
+
+SERIES_STORE_PATH = os.getenv("SERIES_STORE", "series_store.sqlite")
+RETENTION = timedelta(days=int(os.getenv("SERIES_RETENTION_DAYS", "7")))  # at least the longest window read from the store
+INSERT_BATCH = 5000  # rows buffered by add() before they are written
+
+
+class SeriesStore:
+    """SQLite table of measurement rows indexed by (station_id, variable, timestamp).
+
+    Rows are stored under the variable id the station actually reports, the
+    same keys fetch_series() returns, and read back in the API's row layout
+    (newest first), so window queries are drop-in replacements for fetches.
+
+    A second table records, per (station, requested variable), the time span
+    the store is known to hold completely, so a 7-day window is still
+    backfilled for a series that so far was only fetched for 24 hours.
+    """
+
+    def __init__(self, path=SERIES_STORE_PATH):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS measurements ("
+            "station_id TEXT, variable TEXT, ts INTEGER, timestamp TEXT, value, "
+            "PRIMARY KEY (station_id, variable, ts)) WITHOUT ROWID"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS coverage ("
+            "station_id TEXT, variable TEXT, since INTEGER, until INTEGER, "
+            "PRIMARY KEY (station_id, variable)) WITHOUT ROWID"
+        )
+        self.db.commit()
+        self.buffer = []
+
+    def add(self, entry):
+        # Takes rows one at a time as they are streamed in; call flush() once the fetch is done
+        self.buffer.append(
+            (entry["station_id"], entry["variable"], int(parse_timestamp(entry["timestamp"]).timestamp()), entry["timestamp"], entry.get("value"))
+        )
+        if len(self.buffer) >= INSERT_BATCH:
+            self.flush()
+
+    def flush(self):
+        self.db.executemany("INSERT OR REPLACE INTO measurements VALUES (?, ?, ?, ?, ?)", self.buffer)
+        self.db.commit()
+        self.buffer = []
+
+    def high_water(self, station_ids, var_ids, since):
+        # Newest stored timestamp per (station, variable), ignoring series that have gone quiet since `since`
+        rows = self.db.execute(
+            f"SELECT station_id, variable, MAX(ts) FROM measurements "
+            f"WHERE station_id IN ({','.join('?' * len(station_ids))}) "
+            f"AND variable IN ({','.join('?' * len(var_ids))}) AND ts >= ? GROUP BY station_id, variable",
+            (*station_ids, *var_ids, int(since.timestamp()))
+        ).fetchall()
+        return {(station_id, variable): datetime.fromtimestamp(ts, timezone.utc) for station_id, variable, ts in rows}
+
+    def select(self, station_ids, var_ids, start):
+        # (station_id, variable, ts, timestamp, value) rows since start in the API's order: newest first, all variables of a timestamp together
+        return self.db.execute(
+            f"SELECT station_id, variable, ts, timestamp, value FROM measurements "
+            f"WHERE station_id IN ({','.join('?' * len(station_ids))}) "
+            f"AND variable IN ({','.join('?' * len(var_ids))}) AND ts >= ? "
+            f"ORDER BY station_id, ts DESC, variable",
+            (*station_ids, *var_ids, int(start.timestamp()))
+        )
+
+    def coverage(self, station_ids, var_ids):
+        # {station_id: (since, until)} of the span held for every var_id; stations missing any var_id are left out
+        rows = self.db.execute(
+            f"SELECT station_id, MAX(since), MIN(until), COUNT(*) FROM coverage "
+            f"WHERE station_id IN ({','.join('?' * len(station_ids))}) "
+            f"AND variable IN ({','.join('?' * len(var_ids))}) GROUP BY station_id",
+            (*station_ids, *var_ids)
+        ).fetchall()
+        return {
+            station_id: (datetime.fromtimestamp(since, timezone.utc), datetime.fromtimestamp(until, timezone.utc))
+            for station_id, since, until, count in rows if count == len(set(var_ids))
+        }
+
+    def mark_covered(self, station_ids, var_ids, since, until):
+        # Rows from since to until are now held; the span only grows if it joins up with what was held before
+        self.db.executemany(
+            "INSERT INTO coverage VALUES (?, ?, ?, ?) ON CONFLICT (station_id, variable) DO UPDATE SET "
+            "since = CASE WHEN until >= excluded.since THEN MIN(since, excluded.since) ELSE excluded.since END, "
+            "until = excluded.until",
+            [(station_id, variable, int(since.timestamp()), int(until.timestamp())) for station_id in station_ids for variable in var_ids]
+        )
+        self.db.commit()
+
+    def prune(self, before):
+        cutoff = int(before.timestamp())
+        self.db.execute("DELETE FROM measurements WHERE ts < ?", (cutoff,))
+        self.db.execute("UPDATE coverage SET since = ? WHERE since < ?", (cutoff, cutoff))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def stored_variables(station_ids, var_ids, capabilities=None):
+    # Variable ids the rows are stored under: the requested ones plus any per-station variants
+    actual_vars = set(var_ids)
+    if capabilities is not None:
+        actual_vars |= {capabilities.resolve(s, v) for s in station_ids for v in var_ids} - {None}
+    return sorted(actual_vars)
+
+
+async def top_up(engine, store, station_ids, var_ids, hours, now=None, capabilities=None):
+    """Brings the store up to date for the last `hours` and returns the window start.
+
+    A station whose stored span already reaches back to the window start is
+    topped up from its high-water mark: the end of its complete span, or the
+    newest row of its most behind series if that is earlier. Those stations
+    share one delta query starting at the oldest of their marks. Every other
+    station gets the full window. Stations whose requests failed keep their
+    old coverage, so rows a cut-off fetch left after a gap never hide it.
+    """
+    now = now or datetime.now(timezone.utc)
+    start = parse_timestamp(window_start(now, hours))
+    covered = store.coverage(station_ids, var_ids)
+    known = [s for s in station_ids if s in covered and covered[s][0] <= start]
+    fresh = [s for s in station_ids if s not in known]
+
+    # Rows are stored as they stream in, so a fetch cut off part way can leave newer rows after a hole:
+    # only the complete span counts, and a series lagging behind it (samples published late) starts earlier
+    marks = store.high_water(known, stored_variables(known, var_ids, capabilities), start)
+    station_marks = {s: covered[s][1] for s in known}
+    for (station_id, _), ts in marks.items():
+        station_marks[station_id] = min(ts, station_marks[station_id])
+
+    # Rows are written as they stream in rather than collected first
+    queries = []
+    if known:
+        oldest = max(start, min(station_marks.values()))
+        queries.append(stream_series(
+            engine, known, var_ids, oldest.strftime("%Y-%m-%dT%H:%M:%SZ"), rows_since(oldest, now), store.add, capabilities=capabilities
+        ))
+    if fresh:
+        queries.append(stream_series(
+            engine, fresh, var_ids, start.strftime("%Y-%m-%dT%H:%M:%SZ"), window_rows(hours), store.add, capabilities=capabilities
+        ))
+    await asyncio.gather(*queries)
+    store.flush()
+
+    if known:
+        store.mark_covered([s for s in known if s not in engine.incomplete], var_ids, oldest, now)
+    store.mark_covered([s for s in fresh if s not in engine.incomplete], var_ids, start, now)
+    # Cut on the sample grid like window_start(), so a window as long as the retention stays covered
+    store.prune(parse_timestamp(window_start(now, RETENTION.total_seconds() / 3600)))
+    return start
+
+
+async def stream_window(engine, store, station_ids, var_ids, hours, consume, now=None, capabilities=None):
+    # Same rows as stream_series() over the last `hours`, fetching only what the store lacks; returns the row count
+    start = await top_up(engine, store, station_ids, var_ids, hours, now, capabilities)
+    count = 0
+    for station_id, variable, _, timestamp, value in store.select(station_ids, stored_variables(station_ids, var_ids, capabilities), start):
+        consume({"station_id": station_id, "variable": variable, "timestamp": timestamp, "value": value})
+        count += 1
+    return count
@@ -0,0 +1,150 @@
+import os
+import zlib
+
+# Sharded runs: a shard spec picks a subset of the stations, each worker writes its products as a
+# partial file, and the partials are merged into the same files a single run would have written.
+#
+#   hash:2/4           second of four hash partitions (stable across processes and machines)
+#   range:0100-0599    station ids 0100 to 0599 inclusive
+#   island:oahu,maui   stations on those islands (see ISLANDS)
+
+# Second digit of a Hawaii station id -> island, as on the station table; American Samoa ids start with 1
+ISLANDS = {"1": "maui", "2": "hawaii", "4": "molokai", "5": "oahu", "6": "kauai"}
+AMERICAN_SAMOA = "american_samoa"
+
+# Stations whose products are computed together must land in the same shard (see merge_station_0520)
+SHARED_SITES = {"0521": "0520"}
+
+
+def island(station_id):
+    if station_id.startswith("1"):
+        return AMERICAN_SAMOA
+    return ISLANDS.get(station_id[1:2], "unknown")
+
+
+def site(station_id):
+    return SHARED_SITES.get(station_id, station_id)
+
+
+class Shard:
+    """One worker's share of the stations, parsed from a shard spec (see the top of this file)."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        kind, _, arg = spec.partition(":")
+        self.kind = kind
+        try:
+            if kind == "hash":
+                index, count = (int(n) for n in arg.split("/"))
+                if not 1 <= index <= count:
+                    raise ValueError
+                self.index, self.count = index, count
+                self.label = f"hash-{index}-of-{count}"
+            elif kind == "range":
+                low, high = arg.split("-")
+                self.low, self.high = int(low), int(high)
+                self.label = f"range-{low}-{high}"
+            elif kind == "island":
+                self.islands = {name.strip().lower() for name in arg.split(",") if name.strip()}
+                if not self.islands:
+                    raise ValueError
+                self.label = f"island-{'-'.join(sorted(self.islands))}"
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"invalid shard spec {spec!r} (expected hash:I/N, range:LOW-HIGH or island:NAME[,NAME])") from None
+
+    def includes(self, station_id):
+        station_id = site(station_id)
+        if self.kind == "hash":
+            return zlib.crc32(station_id.encode()) % self.count == self.index - 1
+        if self.kind == "range":
+            return station_id.isdigit() and self.low <= int(station_id) <= self.high
+        return island(station_id) in self.islands
+
+
+def shard_path(path, shard):
+    # Per-shard state file, e.g. rainfall_state.json -> rainfall_state.hash-1-of-4.json, so workers never share one
+    root, extension = os.path.splitext(path)
+    return f"{root}.{shard.label}{extension}"
+
+
+def in_order(values, order):
+    # {station_id: value} re-keyed in station order; ids missing from the order go last, sorted
+    ranked = {sid: i for i, sid in enumerate(order)}
+    return {sid: values[sid] for sid in sorted(values, key=lambda sid: (sid not in ranked, ranked.get(sid, 0), sid))}
+
+
+def merge_by_station(parts, order):
+    merged = {}
+    for part in parts:
+        merged.update(part)
+    return in_order(merged, order)
+
+
+def merge_by_name(parts, order):
+    # {name: {station_id: value}} parts; names keep the order they first appear in
+    merged = {}
+    for part in parts:
+        for name, values in part.items():
+            merged.setdefault(name, {}).update(values)
+    return {name: in_order(values, order) for name, values in merged.items()}
+
+
+def merge_products(partials, order):
+    """Combines the products of every partial into the products of one run over all stations.
+
+    `partials` are loaded partial files in a fixed order; stations are laid
+    out in `order` (the full station list), as a single run lays them out.
+    Grids span every station and are not sharded: they are built from the
+    merged data map afterwards.
+    """
+    def parts(name):
+        return [partial["products"][name] for partial in partials if name in partial["products"]]
+
+    products = {}
+    if parts("datamap"):
+        products["datamap"] = merge_by_name(parts("datamap"), order)
+    if parts("wind"):
+        products["wind"] = merge_by_station(parts("wind"), order)
+    if parts("rainfall"):
+        products["rainfall"] = merge_by_station(parts("rainfall"), order)
+    if parts("anomalies"):
+        products["anomalies"] = merge_by_name(parts("anomalies"), order)
+    if parts("aggregates"):
+        products["aggregates"] = merge_by_station(parts("aggregates"), order)
+    if parts("diagnostics"):
+        products["diagnostics"] = (
+            merge_by_name([part[0] for part in parts("diagnostics")], order),
+            merge_by_name([part[1] for part in parts("diagnostics")], order)
+        )
+    if parts("latest"):
+        # Same orders as build_latest: every latest row by (station, variable), earliest rows in station order
+        ranked = {sid: i for i, sid in enumerate(order)}
+        sorted_data = sorted((row for part in parts("latest") for row in part[0]), key=lambda row: (row["station_id"], row["variable"]))
+        filtered_data = sorted((row for part in parts("latest") for row in part[1]), key=lambda row: ranked.get(row["station_id"], len(ranked)))
+        products["latest"] = (sorted_data, filtered_data)
+    return products
+
+
+def merge_freshness(partials, stations):
+    # Stations no partial covered (a worker that failed or never ran) are "missing", and the merged run is not complete
+    statuses = {}
+    for partial in partials:
+        statuses.update(partial["freshness"]["stations"])
+    missing = [s["station_id"] for s in stations if s["station_id"] not in statuses]
+    statuses.update({sid: "missing" for sid in missing})
+    return {
+        "generated": max(partial["freshness"]["generated"] for partial in partials),
+        "complete": not missing and all(partial["freshness"]["complete"] for partial in partials),
+        "stations": in_order(statuses, [s["station_id"] for s in stations])
+    }
+
+
+def merge_stations(partials):
+    # Union of the partials' full station lists, in the first partial's order
+    stations = {}
+    for partial in partials:
+        for station in partial["stations"]:
+            stations.setdefault(station["station_id"], station)
+    return list(stations.values())
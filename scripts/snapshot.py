@@ -0,0 +1,133 @@
+import gzip
+import json
+
+from output import content_hash
+
+try:
+    import brotli
+except ImportError:  # the .br sibling is skipped when brotli is not installed
+    brotli = None
+
+# One compact columnar file per run holding every per-station product, plus .gz/.br copies
+
+COMPACT = (",", ":")
+
+
+def build_snapshot(stations, products, generated=None):
+    """Columnar snapshot of a run's products.
+
+    Every array lines up with the "stations" index, so a station's values
+    are found by position instead of repeating its id in every file:
+
+        {"generated": ..., "stations": [...], "lat": [...], "lon": [...],
+         "variables": {name: {"value": [...], "timestamp": [...], "qc": [...]}},
+         "updated": {variable: [...]}}
+
+    "qc" (quality-control flags, see qc.py) is only there for the
+    variables that carry it. Missing values are null. "updated" holds the latest-stage timestamps.
+    """
+    per_station = {}  # name -> {station_id: {"value", "timestamp"}}
+    if "datamap" in products:
+        per_station.update(products["datamap"])
+    if "rainfall" in products:
+        per_station["RF_1_Tot300s_24H"] = products["rainfall"]
+    if "anomalies" in products:
+        per_station.update(products["anomalies"])
+    if "aggregates" in products:
+        for station_id, values in products["aggregates"].items():
+            for window, fields in values.items():
+                if window == "timestamp":
+                    continue
+                # A window's qc flags go with every field computed over it
+                for field, value in fields.items():
+                    if field != "qc":
+                        per_station.setdefault(f"{field}_{window}", {})[station_id] = {
+                            "value": value, "timestamp": values["timestamp"], "qc": fields.get("qc")
+                        }
+    if "diagnostics" in products:
+        measurements_by_variable, measurements_by_vardiff = products["diagnostics"]
+        per_station.update(measurements_by_variable)
+        per_station.update({f"{name}_diff": values for name, values in measurements_by_vardiff.items()})
+
+    updated = {}
+    if "latest" in products:
+        sorted_data, _ = products["latest"]
+        for entry in sorted_data:
+            updated.setdefault(entry["variable"], {})[entry["station_id"]] = entry["timestamp"]
+
+    station_info = {s["station_id"]: s for s in stations}
+    station_ids = sorted(
+        set(station_info)
+        | {sid for values in per_station.values() for sid in values}
+        | {sid for values in updated.values() for sid in values}
+    )
+
+    def column(values, field):
+        return [(values.get(sid) or {}).get(field) for sid in station_ids]
+
+    def variable_columns(values):
+        columns = {"value": column(values, "value"), "timestamp": column(values, "timestamp")}
+        if any("qc" in (data or {}) for data in values.values()):
+            columns["qc"] = column(values, "qc")
+        return columns
+
+    return {
+        "generated": generated,
+        "stations": station_ids,
+        "lat": [station_info.get(sid, {}).get("lat") for sid in station_ids],
+        "lon": [station_info.get(sid, {}).get("lng") for sid in station_ids],
+        "variables": {name: variable_columns(values) for name, values in per_station.items()},
+        "updated": {variable: [values.get(sid) for sid in station_ids] for variable, values in updated.items()}
+    }
+
+
+def write_snapshot(snapshot, filename, writer):
+    # No indentation; the compressed siblings are what a client with Accept-Encoding should fetch.
+    # The run time alone does not make a new snapshot, so "generated" is when the data last changed
+    data = json.dumps(snapshot, separators=COMPACT).encode()
+    digest = content_hash(snapshot, ignore=("generated",))
+    writer.write_bytes(filename, data, digest)
+    writer.write_bytes(f"{filename}.gz", gzip.compress(data, compresslevel=9, mtime=0), digest)
+    if brotli is not None:
+        writer.write_bytes(f"{filename}.br", brotli.compress(data, quality=11), digest)
+    print(f"Snapshot is {len(data)} bytes uncompressed")
+
+
+def read_snapshot(filename):
+    # Accepts the plain, .gz or .br file
+    with open(filename, "rb") as snapshot_file:
+        data = snapshot_file.read()
+    if filename.endswith(".gz"):
+        data = gzip.decompress(data)
+    elif filename.endswith(".br"):
+        if brotli is None:
+            raise RuntimeError("brotli is not installed; read the .json or .json.gz snapshot instead")
+        data = brotli.decompress(data)
+    return json.loads(data)
+
+
+def station_values(snapshot, name):
+    # Back to the per-file layout, e.g. station_values(snapshot, "Tair_1_Avg") is Tair_1_Avg.json without
+    # the stations whose value and timestamp are both null (the snapshot cannot tell those from absent ones)
+    columns = snapshot["variables"][name]
+    values = {}
+    for index, (sid, value, timestamp) in enumerate(zip(snapshot["stations"], columns["value"], columns["timestamp"])):
+        if value is not None or timestamp is not None:
+            values[sid] = {"value": value, "timestamp": timestamp} if timestamp is not None else {"value": value}
+            if "qc" in columns:
+                values[sid]["qc"] = columns["qc"][index]
+    return values
+
+
+def station_record(snapshot, station_id):
+    # Everything the snapshot knows about one station, keyed by variable name
+    index = snapshot["stations"].index(station_id)
+    record = {
+        name: {field: column[index] for field, column in columns.items()}
+        for name, columns in snapshot["variables"].items()
+        if columns["value"][index] is not None or columns["timestamp"][index] is not None
+    }
+    record["updated"] = {
+        variable: timestamps[index] for variable, timestamps in snapshot["updated"].items() if timestamps[index] is not None
+    }
+    return record
@@ -0,0 +1,56 @@
+import codecs
+import json
+
+# Incremental decoding of a JSON array response: elements are handed out as their bytes arrive,
+# so a large measurements body never has to sit in memory as a whole
+
+CHUNK_SIZE = 64 * 1024
+SEPARATORS = " \t\r\n,"
+
+
+async def iter_json_array(chunks):
+    """Yields the elements of a top-level JSON array read from an async iterator of byte chunks.
+
+    Only the undecoded tail of the body is buffered. An element is only
+    taken once a character follows it, so a number cut off at a chunk
+    boundary is never read short. Raises ValueError for anything but an array.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    async for chunk in chunks:
+        buffer += text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in SEPARATORS:
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("response is not a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # the element continues in the next chunk
+            if end == len(buffer):
+                break
+            yield element
+            pos = end
+        buffer = buffer[pos:]
+    raise ValueError("response ended inside the JSON array")
+
+
+def to_number(value):
+    # Float value of a row, or None for anything pandas.to_numeric(errors="coerce") would turn into NaN
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if number != number else number